@@ -1,17 +1,99 @@
 import os
-from google import genai
-from google.genai import types
+import asyncio
+import random
+import logging
+import threading
+from google.genai import errors
+from app.rate_limiter import RedisTokenBucket
+from app.llm_backends import GEMINI_MODEL, LLMBackend, make_backend
 
-def generate(system_prompt, user_prompt):
-    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=user_prompt,
-        config=types.GenerateContentConfig(
-            system_instruction=system_prompt,
-            tools=[types.Tool(google_search=types.GoogleSearch())],
-            response_modalities=["TEXT"]
-        )
+logger = logging.getLogger(__name__)
+
+# Global across every worker, shared through Redis
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 60))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 250000))
+# Requests in flight from one worker process, whatever the bucket allows
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", 8))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
+LLM_MAX_BACKOFF = 30
+# Charged against the token bucket for the answer on top of the prompt
+LLM_OUTPUT_TOKENS = 512
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+limiter = RedisTokenBucket(
+    f"ratelimit:llm:{GEMINI_MODEL}",
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+)
+
+_backend = None
+_loop = None
+_in_flight = asyncio.Semaphore(LLM_MAX_IN_FLIGHT)
+_lock = threading.Lock()
+
+def get_backend() -> LLMBackend:
+    """The process-wide backend chosen by LLM_BACKEND, created on first use."""
+    global _backend
+    with _lock:
+        if _backend is None:
+            _backend = make_backend()
+        return _backend
+
+def set_backend(backend: LLMBackend):
+    """Swap the backend, e.g. to a stub in a benchmark."""
+    global _backend
+    with _lock:
+        _backend = backend
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    # One loop thread per process owns the async client and its connections,
+    # so they are reused across jobs instead of tied to a per-call loop.
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True).start()
+        return _loop
+
+def run_async(coro):
+    """Schedule `coro` on the LLM loop; returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop())
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for code and English
+    return len(text) // 4 + 1
+
+async def generate_async(system_prompt, user_prompt):
+    prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+    cost = prompt_tokens + LLM_OUTPUT_TOKENS
+    backend = get_backend()
+    logger.info(
+        f"LLM request of ~{prompt_tokens} prompt tokens",
+        extra={"prompt_tokens": prompt_tokens, "model": backend.model_id},
     )
-    return response.text.strip() if response.text else ""
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        if backend.rate_limited:
+            await limiter.acquire(cost)
+        try:
+            async with _in_flight:
+                return await asyncio.wait_for(
+                    backend.generate(system_prompt, user_prompt),
+                    LLM_TIMEOUT,
+                )
+        except (asyncio.TimeoutError, errors.APIError) as e:
+            if isinstance(e, errors.APIError) and e.code not in RETRYABLE_STATUS:
+                raise
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            # Full jitter: spread retries from many workers over the window
+            delay = random.uniform(0, min(LLM_MAX_BACKOFF, 2 ** (attempt + 1)))
+            logger.warning(
+                f"LLM call failed, retrying in {delay:.1f}s: {e!r}",
+                extra={"attempt": attempt + 1},
+            )
+            await asyncio.sleep(delay)
+
+def generate(system_prompt, user_prompt):
+    return run_async(generate_async(system_prompt, user_prompt)).result()
@@ -1,5 +1,5 @@
 import json
-from app.redis_client import redis_client
+from app.redis_client import redis_client, redis_binary_client
 
 CACHE_TTL = 3600 # 1 hour
 
@@ -10,3 +10,23 @@ def cache_get(key: str):
 def cache_set(key: str, value, ttl: int = CACHE_TTL):
     raw = json.dumps(value)
     redis_client.set(key, raw, ex=ttl)
+
+def cache_get_many(keys: list) -> list:
+    if not keys:
+        return []
+    raws = redis_client.mget(keys)
+    return [None if raw is None else json.loads(raw) for raw in raws]
+
+def cache_set_many(items: dict, ttl: int = CACHE_TTL):
+    if not items:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for key, value in items.items():
+        pipe.set(key, json.dumps(value), ex=ttl)
+    pipe.execute()
+
+def cache_get_bytes(key: str) -> bytes | None:
+    return redis_binary_client.get(key)
+
+def cache_set_bytes(key: str, value: bytes, ttl: int = CACHE_TTL):
+    redis_binary_client.set(key, value, ex=ttl)
@@ -1,15 +1,25 @@
 from collections import defaultdict
 from typing import Dict, List, Set
 from app.models import FileIndex
-from app.static_analysis import parse_code, walk, resolve_import
+from app.static_analysis import (
+    detect_module_prefix,
+    import_module_parts,
+    module_file_in_index,
+    resolve_import_in_index,
+    parse_code,
+    extract_symbols,
+)
 import os, subprocess
 from app.confidence import compute_confidence, confidence_label
 from app.llm_service import explain_impact
 
 CALL_SNIPPET_WINDOW = 4
 
+def make_symbol_id(file, kind, name):
+    return f"{file}:{kind}:{name}"
+
 def symbol_id(sym):
-    return f"{sym.file}:{sym.kind}:{sym.name}"
+    return make_symbol_id(sym.file, sym.kind, sym.name)
 
 def resolve_import_to_file(import_stmt: str) -> str | None:
     if import_stmt.startswith("from "):
@@ -21,14 +31,17 @@ def resolve_import_to_file(import_stmt: str) -> str | None:
     return module.replace(".", "/") + ".py"
 
 def build_file_graph(repo_dir, repo_index):
-    module_root = detect_module_root(repo_dir)
+    # Resolve against indexed paths so results line up with repo_index keys.
+    known_files = set(repo_index)
+    module_prefix = detect_module_prefix(known_files)
     graph = defaultdict(set)
     for file_path, fi in repo_index.items():
         for imp in fi.imports:
-            target = resolve_import(
+            target = resolve_import_in_index(
                 import_stmt=imp,
                 current_file=file_path,
-                module_root=module_root,
+                known_files=known_files,
+                module_prefix=module_prefix,
             )
             if target:
                 graph[file_path].add(target)
@@ -72,24 +85,142 @@ def build_file_graph(repo_dir, repo_index):
 
 #     return symbol_graph
 
-def extract_function_calls(tree):
-    calls = []
+def import_bindings(fi, known_files, module_prefix):
+    """Map names bound by a file's imports to (target file, symbol or None for a module).
 
-    for node in walk(tree.root_node):
-        if node.type == "call":
-            fn = node.child_by_field_name("function")
-            if fn is None:
-                continue
+    Also returns the modules pulled in by star imports and the names bound to
+    modules outside the repo.
+    """
+    bindings = {}
+    star_modules = []
+    external = set()
 
-            name = fn.text.decode()
-            line = node.start_point[0] + 1 
+    for imp in fi.imports:
+        parts = import_module_parts(imp, fi.path, module_prefix)
+        if not parts:
+            continue
 
-            calls.append({
-                "name": name,
-                "line": line,
-            })
+        if imp["type"] == "import":
+            if imp.get("alias"):
+                target = module_file_in_index(parts, known_files)
+                if target:
+                    bindings[imp["alias"]] = (target, None)
+                else:
+                    external.add(imp["alias"])
+                continue
+            # "import a.b" makes both "a" and "a.b" usable as qualifiers
+            offset = len(parts) - len(imp["module"].split("."))
+            for i in range(offset + 1, len(parts) + 1):
+                target = module_file_in_index(parts[:i], known_files)
+                if target:
+                    bindings[".".join(parts[offset:i])] = (target, None)
+            if module_file_in_index(parts[:offset + 1], known_files) is None:
+                external.add(imp["module"].split(".")[0])
+
+        elif "names" in imp:
+            module_target = module_file_in_index(parts, known_files)
+            for name, alias in imp["names"]:
+                if name == "*":
+                    if module_target:
+                        star_modules.append(module_target)
+                    continue
+                # "from pkg import mod" may name a submodule rather than a symbol
+                submodule = module_file_in_index(parts + [name], known_files)
+                if submodule:
+                    bindings[alias or name] = (submodule, None)
+                elif module_target:
+                    bindings[alias or name] = (module_target, name)
+                else:
+                    external.add(alias or name)
+
+        else:
+            # "from . import mod"
+            target = module_file_in_index(parts, known_files)
+            if target:
+                bindings[imp.get("alias") or imp["module"]] = (target, None)
+
+    return bindings, star_modules, external
+
+class CallResolver:
+    """Resolves call names to symbol ids through each file's imports."""
+
+    MAX_REEXPORT_HOPS = 5
+
+    def __init__(self, repo_index, file_graph):
+        known_files = set(repo_index)
+        module_prefix = detect_module_prefix(known_files)
+
+        self.definitions = {}
+        self.bindings = {}
+        self.star_modules = {}
+        self.external = {}
+        for path, fi in repo_index.items():
+            self.definitions[path] = {sym.name: symbol_id(sym) for sym in fi.symbols}
+            (
+                self.bindings[path],
+                self.star_modules[path],
+                self.external[path],
+            ) = import_bindings(fi, known_files, module_prefix)
+        self.file_graph = file_graph
+
+    def resolve_in_file(self, file_path, name, hops=0):
+        """Find `name` as defined in, or re-exported by, `file_path`."""
+        sid = self.definitions.get(file_path, {}).get(name)
+        if sid or hops >= self.MAX_REEXPORT_HOPS:
+            return sid
+
+        binding = self.bindings.get(file_path, {}).get(name)
+        if binding and binding[1]:
+            return self.resolve_in_file(binding[0], binding[1], hops + 1)
+
+        for star in self.star_modules.get(file_path, []):
+            sid = self.resolve_in_file(star, name, hops + 1)
+            if sid:
+                return sid
+        return None
 
-    return calls
+    def resolve(self, file_path, call_name):
+        parts = call_name.split(".")
+        attr = parts[-1]
+        if not attr.isidentifier():
+            return None
+
+        bindings = self.bindings.get(file_path, {})
+
+        # helper()
+        if len(parts) == 1:
+            return self.resolve_in_file(file_path, attr)
+
+        # module.helper() / alias.helper() / ImportedClass.method()
+        qualifier = ".".join(parts[:-1])
+        binding = bindings.get(qualifier)
+        if binding:
+            target, name = binding
+            if name is None:
+                return self.resolve_in_file(target, attr)
+            class_sid = self.resolve_in_file(target, name)
+            if class_sid:
+                return self.definitions[class_sid.rsplit(":", 2)[0]].get(attr)
+            return None
+
+        # os.path.join(), requests.get(): not part of this repo
+        if parts[0] in self.external.get(file_path, ()):
+            return None
+
+        if parts[0] in ("self", "cls") and len(parts) == 2:
+            sid = self.definitions.get(file_path, {}).get(attr)
+            if sid:
+                return sid
+
+        # obj.method(): only link when exactly one file in scope defines it
+        candidates = {
+            self.definitions[f][attr]
+            for f in [file_path, *self.file_graph.get(file_path, ())]
+            if attr in self.definitions.get(f, {})
+        }
+        if len(candidates) == 1:
+            return candidates.pop()
+        return None
 
 def build_symbol_graph(repo_dir, repo_index):
     symbol_graph = defaultdict(lambda: defaultdict(lambda: {
@@ -97,26 +228,15 @@ def build_symbol_graph(repo_dir, repo_index):
         "lines": [],
     }))
 
-    symbol_lookup = {}
-    for fi in repo_index.values():
-        for sym in fi.symbols:
-            symbol_lookup[sym.name] = symbol_id(sym)
+    resolver = CallResolver(repo_index, build_file_graph(repo_dir, repo_index))
 
+    # Call sites were collected when the file was indexed, so no re-parse here.
     for fi in repo_index.values():
-        abs_path = os.path.join(repo_dir, fi.path)
-        if not os.path.exists(abs_path):
-            continue
-
-        code = open(abs_path, "r", encoding="utf-8").read()
-        tree = parse_code(code)
-        calls = extract_function_calls(tree)
-
-        for call in calls:
-            name = call["name"].split(".")[-1]
-            if name not in symbol_lookup:
+        for call in fi.calls:
+            sid = resolver.resolve(fi.path, call["name"])
+            if sid is None:
                 continue
 
-            sid = symbol_lookup[name]
             entry = symbol_graph[fi.path][sid]
 
             entry["count"] += 1
@@ -160,7 +280,10 @@ def detect_module_root(repo_dir):
         return src
     return repo_dir
 
-def extract_code_snippet(path: str, start_line: int, end_line: int) -> str:
+def extract_code_snippet(path: str, start_line: int, end_line: int, line_store=None) -> str:
+    if line_store is not None:
+        return line_store.get_lines(path, start_line, end_line)
+
     if not os.path.exists(path):
         return ""
     with open(path, "r", encoding="utf-8") as f:
@@ -170,7 +293,10 @@ def extract_code_snippet(path: str, start_line: int, end_line: int) -> str:
     end = min(len(lines), end_line)
     return "\n".join(lines[start-1:end]) if start <= end else ""
 
-def extract_call_site_snippet(path, line_no, window=4):
+def extract_call_site_snippet(path, line_no, window=4, line_store=None):
+    if line_store is not None:
+        return line_store.get_lines(path, line_no - window, line_no + window)
+
     with open(path, "r", encoding="utf-8") as f:
         lines = f.read().splitlines()
 
@@ -178,26 +304,68 @@ def extract_call_site_snippet(path, line_no, window=4):
     end = min(len(lines), line_no + window)
     return "\n".join(lines[start-1:end])
 
+def build_caller_index(symbol_graph):
+    """Map each called symbol id to the files calling it."""
+    callers = defaultdict(list)
+    for file_path, callees in symbol_graph.items():
+        for sid, meta in callees.items():
+            callers[sid].append([file_path, meta["count"], meta["lines"]])
+    return dict(callers)
+
+def build_definition_index(repo_index):
+    """Map each symbol id to where it is defined."""
+    definitions = {}
+    for fi_path, fi in repo_index.items():
+        for sym in fi.symbols:
+            definitions.setdefault(symbol_id(sym), [fi_path, sym.start, sym.end])
+    return definitions
+
 def find_impacts_with_confidence_and_context(
     changed_symbols,
     symbol_graph,
     repo_dir,
     repo_index,
     base_sha,
+    callers=None,
+    definitions=None,
+    object_reader=None,
+    line_store=None,
+    changed_ids=None,
 ):
-    changed_names = {name for _, name in changed_symbols}
-    impacts = []
-
-    for file_path, callees in symbol_graph.items():
-        for sid, meta in callees.items():
-            _, _, name = sid.split(":")
-
-            if name not in changed_names:
-                continue
+    if callers is None:
+        callers = build_caller_index(symbol_graph)
+    if definitions is None:
+        definitions = build_definition_index(repo_index)
+    if changed_ids is None:
+        # Without the defining files, fall back to matching by name.
+        changed_names = {name for _, name in changed_symbols}
+        changed_ids = [sid for sid in callers if sid.rsplit(":", 1)[-1] in changed_names]
 
-            count = meta["count"]
-            lines = meta["lines"]
+    impacts = []
 
+    for sid in set(changed_ids):
+        if sid not in callers:
+            continue
+        name = sid.rsplit(":", 1)[-1]
+
+        # BEFORE/AFTER bodies are shared by every caller of the symbol.
+        after_code = ""
+        before_code = ""
+        definition = definitions.get(sid)
+        if definition:
+            fi_path, start, end = definition
+            abs_def_path = os.path.join(repo_dir, fi_path)
+            after_code = extract_code_snippet(abs_def_path, start, end, line_store)
+            if object_reader is not None:
+                base_text = object_reader.show(base_sha, fi_path)
+            else:
+                base_text = git_show_file(repo_dir, base_sha, fi_path)
+            # The symbol may sit on other lines at the base revision
+            base_span = locate_symbol(base_text, sid.rsplit(":", 2)[1], name, start)
+            if base_span:
+                before_code = extract_code_snippet_from_text(base_text, *base_span)
+
+        for file_path, count, lines in callers[sid]:
             score = compute_confidence(file_path, name, count)
             label = confidence_label(score)
 
@@ -208,37 +376,13 @@ def find_impacts_with_confidence_and_context(
                 abs_impacted,
                 call_site_line,
                 CALL_SNIPPET_WINDOW,
+                line_store,
             )
 
-            after_code = ""
-            before_code = ""
-
-            for fi_path, fi in repo_index.items():
-                for sym in fi.symbols:
-                    if sym.name == name:
-                        abs_def_path = os.path.join(repo_dir, fi_path)
-                        after_code = extract_code_snippet(
-                            abs_def_path,
-                            sym.start,
-                            sym.end,
-                        )
-                        base_text = git_show_file(
-                            repo_dir,
-                            base_sha,
-                            fi_path,
-                        )
-                        before_code = extract_code_snippet_from_text(
-                            base_text,
-                            sym.start,
-                            sym.end,
-                        )
-                        break
-                if after_code:
-                    break
-
             impacts.append({
                 "file": file_path,
                 "symbol": name,
+                "symbol_id": sid,
                 "call_count": count,
                 "call_site_line": call_site_line,
                 "call_site_code": call_site_code,
@@ -264,6 +408,21 @@ def git_show_file(repo_dir:str, commit_sha:str, file_path:str) -> str:
     return result.stdout
     
 
+def locate_symbol(text: str, kind: str, name: str, near_line: int):
+    """(start, end) of the `kind` symbol called `name` in `text`, closest to `near_line`."""
+    if not text:
+        return None
+    symbols = extract_symbols(parse_code(text))
+    key = "functions" if kind == "function" else "classes"
+    spans = [
+        (sym["start_line"], sym["end_line"])
+        for sym in symbols[key]
+        if sym["name"] == name
+    ]
+    if not spans:
+        return None
+    return min(spans, key=lambda span: abs(span[0] - near_line))
+
 def extract_code_snippet_from_text(
     text: str,
     start_line: int,
@@ -0,0 +1,68 @@
+import subprocess
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class GitObjectReader:
+    """Serves blobs from one long-lived `git cat-file --batch` process per job."""
+
+    def __init__(self, repo_dir: str, git_args: list | None = None):
+        self.repo_dir = repo_dir
+        # Extra `-c` flags, e.g. credentials for lazy fetches in a partial clone
+        self.git_args = git_args or []
+        self._proc = None
+        self._lock = threading.Lock()
+        self._texts = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _start(self):
+        self._proc = subprocess.Popen(
+            ["git", *self.git_args, "cat-file", "--batch"],
+            cwd=self.repo_dir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def read_object(self, spec: str) -> bytes | None:
+        """Return the raw contents of `spec` (a sha or `rev:path`), or None if missing."""
+        with self._lock:
+            if self._proc is None:
+                self._start()
+            self._proc.stdin.write(spec.encode("utf-8") + b"\n")
+            self._proc.stdin.flush()
+
+            header = self._proc.stdout.readline()
+            if not header:
+                raise RuntimeError(f"git cat-file exited while reading {spec}")
+            # "<spec> missing" / "<spec> ambiguous"; the spec may contain spaces
+            if header.endswith((b" missing\n", b" ambiguous\n")):
+                return None
+
+            size = int(header.rsplit(None, 2)[2])
+            data = self._proc.stdout.read(size)
+            self._proc.stdout.read(1)  # trailing newline
+            return data
+
+    def show(self, commit_sha: str, file_path: str) -> str:
+        key = (commit_sha, file_path)
+        if key not in self._texts:
+            data = self.read_object(f"{commit_sha}:{file_path}")
+            self._texts[key] = "" if data is None else data.decode("utf-8", errors="replace")
+        return self._texts[key]
+
+    def close(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+            self._proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+        self._proc = None
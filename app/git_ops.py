@@ -1,39 +1,67 @@
 import requests
+import asyncio
 import os, subprocess
-from app.github import get_github_token
-from app.static_analysis import (
-    changed_files_from_diff,
-    changed_lines_from_diff,
-    parse_code,
-    extract_symbols,
-    extract_imports,
-    find_changed_symbols,
+from functools import partial
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from app.github import (
+    COMMENT_EDIT_INTERVAL,
+    GitHubFileReader,
+    get_github_token,
+    get_merge_base,
+    github_get_json,
+    iter_compare_diff,
 )
+from app.static_analysis import parse_diff, find_changed_symbols
 from app.dependency_graph import (
     build_file_graph,
     build_symbol_graph,
+    build_caller_index,
+    build_definition_index,
+    make_symbol_id,
     find_impacts_with_confidence_and_context,
 )
-from app.llm_service import explain_impact
-from app.repo_index import build_repo_index
-from app.cache import cache_get, cache_set
-from app.models import serialize_repo_index, deserialize_repo_index, serialize_symbol_graph, deserialize_symbol_graph
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from app.llm_service import (
+    explain_impact_async,
+    explain_impacts_batch_async,
+    explanation_cache_hits,
+    batch_call_sites,
+    batch_prompt,
+    impact_prompt,
+    prompt_cost,
+)
+from app.llm_scheduler import LLMTask, run_scheduled
+from app.api_service import run_async
+from app.repo_index import (
+    build_repo_index_cached,
+    build_repo_index_from_objects,
+    list_python_blobs,
+    symbols_by_kind,
+)
+from app.cache import cache_get, cache_set, cache_get_bytes, cache_set_bytes
+from app.git_objects import GitObjectReader
+from app.mirror import (
+    MIRRORS_ENABLED,
+    add_worktree,
+    auth_args,
+    find_warm_mirror,
+    prefetch_blobs,
+    prepare_mirror,
+)
+from app.line_store import LineStore
+from app.pr_jobs import JobSuperseded, check_current
+from app.impact_graph import build_reverse_call_csr, find_transitive_impacts
+from app.models import DiffStats, encode_graph, decode_graph
 
 import logging
 logger = logging.getLogger(__name__)
 
-GITHUB_API = "https://api.github.com"
+# Index straight from a blobless mirror's object store, with no working tree.
+CHECKOUT_FREE_INDEXING = MIRRORS_ENABLED and os.getenv("CHECKOUT_FREE_INDEXING", "0") == "1"
+# Explain every call site of a changed symbol in shared requests
+LLM_BATCH_EXPLAIN = os.getenv("LLM_BATCH_EXPLAIN", "1") == "1"
 
 def get_pr_info(repo:str, pr_number:int):
-    url = f"{GITHUB_API}/repos/{repo}/pulls/{pr_number}"
-    response = requests.get(url, headers={
-            "Authorization": f"Bearer {get_github_token(repo)}",
-            "Accept": "application/vnd.github+json",
-        }
-    )
-    response.raise_for_status()
-    pr_data = response.json()
+    pr_data = github_get_json(f"/repos/{repo}/pulls/{pr_number}", get_github_token(repo))
     return  pr_data
 
 def clone_repo(repo:str, token:str, dest:str):
@@ -44,29 +72,106 @@ def checkout_pr_branch(repo_dir:str, pr_ref:int):
     subprocess.run(["git", "fetch", "origin", pr_ref], cwd=repo_dir, check=True)
     subprocess.run(["git", "checkout", "FETCH_HEAD"], cwd=repo_dir, check=True)
 
-def compute_diff_stats(repo_dir:str, base_sha:str):
-    result = subprocess.run(["git","diff",base_sha], cwd=repo_dir, check=True, capture_output=True, text=True)
-    return result.stdout
-
-def summarize_diff(diff:str) -> str:
-    files = set()
-    added = removed = 0
-    for line in diff.splitlines():
-        if line.startswith("+++ b/") or line.startswith("--- a/"):
-            filename = line[6:] if line.startswith("+++ b/") else line[6:]
-            files.add(filename)
-        elif line.startswith("+") and not line.startswith("+++"):
-            added += 1
-        elif line.startswith("-") and not line.startswith("---"):
-            removed += 1
+def compute_diff_stats(repo_dir:str, base_sha:str, head_sha:str | None = None, git_args=None) -> DiffStats:
+    # Without head_sha, diff against the working tree
+    revs = [base_sha, head_sha] if head_sha else [base_sha]
+    # Parsed straight off the pipe, so the diff text is never held in memory
+    proc = subprocess.Popen(
+        ["git", *(git_args or []), "diff", *revs],
+        cwd=repo_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        errors="replace",
+    )
+    with proc:
+        stats = parse_diff(proc.stdout)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
+    return stats
+
+def find_merge_base(repo_dir: str, base_sha: str, head: str, git_args=None) -> str:
+    result = subprocess.run(
+        ["git", *(git_args or []), "merge-base", base_sha, head],
+        cwd=repo_dir,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        # e.g. a shallow clone that stops short of the fork point
+        logger.warning(f"No merge base for {base_sha[:12]} and {head}, diffing from the base tip")
+        return base_sha
+    return result.stdout.strip()
+
+def summarize_diff(diff: DiffStats) -> str:
+    files = set(diff.files) | set(diff.old_files)
     return (
         "PR Change Summary:\n"
         f"Changed files: {len(files)}\n"
-        f"Lines added: {added}\n"
-        f"Lines removed: {removed}\n"
+        f"Lines added: {diff.added}\n"
+        f"Lines removed: {diff.removed}\n"
     )
     
-def clone_and_analyze_pr(repo: str, pr_number: int, workspace: str) -> str:
+def load_cached_graph(graph_cache_key: str):
+    cached_graph = cache_get_bytes(graph_cache_key)
+    if not cached_graph:
+        return None
+    try:
+        return decode_graph(cached_graph)
+    except ValueError as e:
+        logger.warning(f"Ignoring unreadable graph cache entry: {e}")
+        return None
+
+def render_summary(diff, changed_symbols, impacts, transitive_impacts, unexplained=0, pending=False) -> str:
+    summary = summarize_diff(diff)
+
+    if changed_symbols:
+        summary += "\nChanged symbols:\n"
+        for kind, name in set(changed_symbols):
+            summary += f"- {kind}: {name}\n"
+
+    if impacts:
+        summary += "\nImpacted files:\n"
+        for r in impacts:
+            summary += (
+                f"- {r['file']} "
+                f"(symbol: {r['symbol']}, confidence: {r['label']})\n"
+            )
+            if r.get("explanation"):
+                summary += f"  ↳ {r['explanation']}\n"
+            elif pending:
+                summary += "  ↳ _explanation pending…_\n"
+            else:
+                # Structural facts only, when the LLM phase skipped or failed it
+                summary += f"  ↳ {r['call_count']} call site(s), first at line {r['call_site_line']}\n"
+        if unexplained:
+            summary += f"\n{unexplained} lower-priority impact(s) were not explained to stay within this review's time and token budget.\n"
+
+    if transitive_impacts:
+        summary += "\nIndirectly impacted files:\n"
+        for r in transitive_impacts:
+            summary += (
+                f"- {r['file']} "
+                f"(symbol: {r['symbol']} via {r['via']}, depth: {r['depth']}, confidence: {r['label']})\n"
+            )
+
+    return summary
+
+def clone_and_analyze_pr(
+    repo: str,
+    pr_number: int,
+    workspace: str,
+    on_progress=None,
+    head_sha: str | None = None,
+) -> str:
+    """Analyze the PR and return the review summary.
+
+    `on_progress`, if given, is called with partial summaries while
+    explanations are still being generated. `head_sha` is the push this
+    job was queued for; once a newer one is recorded, the job raises
+    JobSuperseded at the next phase boundary.
+    """
+    check_current(repo, pr_number, head_sha)
     pr = get_pr_info(repo, pr_number)
     commit_sha = pr["head"]["sha"]
     summary_cache_key = f"summary:{repo}:{commit_sha}"
@@ -79,91 +184,254 @@ def clone_and_analyze_pr(repo: str, pr_number: int, workspace: str) -> str:
     token = get_github_token(repo)
     base_sha = pr["base"]["sha"]
     repo_dir = os.path.join(workspace, "repo")
-    graph_cache_key = f"graph:{repo}:{commit_sha}"
+    graph_cache_key = f"graph:v3:{repo}:{commit_sha}"
+    graph = load_cached_graph(graph_cache_key)
+    git_args = []
+    # repo_dir is a bare mirror read at commit_sha rather than a checkout
+    object_mode = False
+    # Set when files are read through the GitHub API instead of git
+    file_reader = None
+    diff = None
 
     # ---- Phase 2: Clone + diff ----
-    # We only clone if we missed the summary cache
-    clone_repo(repo, token, repo_dir)
-    checkout_pr_branch(repo_dir, pr["head"]["ref"])
+    # We only clone if we missed the summary cache. With the graph cached,
+    # only the diff and a handful of files are needed, so try cheaper sources.
+    warm_mirror = None
+    if graph and MIRRORS_ENABLED:
+        warm_mirror = find_warm_mirror(repo, [base_sha, commit_sha])
+
+    if warm_mirror:
+        repo_dir = warm_mirror
+        object_mode = True
+        logger.info("Graph cache hit - reading the warm mirror")
+    elif graph:
+        try:
+            diff_base = get_merge_base(repo, base_sha, commit_sha, token)
+            diff = parse_diff(iter_compare_diff(repo, base_sha, commit_sha, token))
+            file_reader = GitHubFileReader(repo, token)
+            logger.info("Graph cache hit - reading through the GitHub API")
+        except requests.RequestException as e:
+            logger.warning(f"Compare API unavailable, falling back to a checkout: {e}")
+            # The checkout below recomputes the diff and its merge base together
+            diff = None
+
+    def acquire_checkout():
+        # Returns (repo_dir, object_mode) for a local copy at commit_sha
+        if CHECKOUT_FREE_INDEXING:
+            # Everything below reads the bare mirror; only blobs we parse or diff are fetched
+            return prepare_mirror(repo, token, [base_sha, commit_sha], partial=True), True
+        checkout_dir = os.path.join(workspace, "repo")
+        if MIRRORS_ENABLED:
+            # Incremental fetch into the warm mirror, then a cheap worktree checkout
+            add_worktree(repo, token, commit_sha, checkout_dir)
+        else:
+            clone_repo(repo, token, checkout_dir)
+            checkout_pr_branch(checkout_dir, pr["head"]["ref"])
+        return checkout_dir, False
 
-    diff = compute_diff_stats(repo_dir, base_sha)
-    changed_files = changed_files_from_diff(diff)
-    changed_lines = changed_lines_from_diff(diff)
+    if not (object_mode or file_reader):
+        repo_dir, object_mode = acquire_checkout()
+
+    # Every path diffs from the merge base, like the compare API and the PR's
+    # Files tab, so a head gets the same changed lines whichever path ran.
+    if object_mode:
+        git_args = auth_args(token)
+        diff_base = find_merge_base(repo_dir, base_sha, commit_sha, git_args)
+        diff = compute_diff_stats(repo_dir, diff_base, commit_sha, git_args)
+    elif diff is None:
+        diff_base = find_merge_base(repo_dir, base_sha, "HEAD")
+        diff = compute_diff_stats(repo_dir, diff_base)
+    changed_files = diff.files
+    check_current(repo, pr_number, head_sha)
 
     # ---- Phase 4: Load or build graph ----
-    cached_graph = cache_get(graph_cache_key)
-    if cached_graph:
-        repo_index = deserialize_repo_index(cached_graph["repo_index"])
-        symbol_graph = deserialize_symbol_graph(cached_graph["symbol_graph"])
+    if graph:
+        repo_index, symbol_graph = graph
         logger.info("Graph cache hit")
     else:
-        repo_index = build_repo_index(repo_dir)
+        # Per-file entries are keyed by blob SHA, so only new blobs are parsed.
+        if object_mode:
+            with GitObjectReader(repo_dir, git_args) as object_reader:
+                repo_index = build_repo_index_from_objects(
+                    repo_dir,
+                    commit_sha,
+                    object_reader,
+                    prefetch=lambda shas: prefetch_blobs(repo_dir, token, commit_sha, shas),
+                )
+        else:
+            repo_index = build_repo_index_cached(repo_dir)
         symbol_graph = build_symbol_graph(repo_dir, repo_index)
-        cache_set(graph_cache_key, {
-            "repo_index": serialize_repo_index(repo_index),
-            "symbol_graph": serialize_symbol_graph(symbol_graph),
-        })
+        cache_set_bytes(graph_cache_key, encode_graph(repo_index, symbol_graph))
         logger.info("Graph cache miss - Built new graph")
+        check_current(repo, pr_number, head_sha)
+
+    # Both are plain transposes of the graph, cheaper to rebuild than to store.
+    callers = build_caller_index(symbol_graph)
+    definitions = build_definition_index(repo_index)
 
     # ---- Phase 3: Detect changed symbols ----
     changed_symbols = []
+    changed_ids = []
     for file in changed_files:
         if not file.endswith(".py"): continue
-        path = os.path.join(repo_dir, file)
-        if not os.path.exists(path): continue
+        # Symbols come from the repo index, which already parsed every file.
+        fi = repo_index.get(file)
+        if fi is None: continue
 
-        tree = parse_code(open(path).read())
-        symbols = extract_symbols(tree)
-        changed_symbols.extend(find_changed_symbols(symbols, changed_lines))
+        symbols = symbols_by_kind(fi)
+        found = find_changed_symbols(symbols, diff.changed_lines.get(file, []))
+        changed_symbols.extend(found)
+        changed_ids.extend(make_symbol_id(file, kind, name) for kind, name in found)
 
     # ---- Phase 4.5: Impact + confidence ----
-    impacts = find_impacts_with_confidence_and_context(
-        changed_symbols=changed_symbols,
-        symbol_graph=symbol_graph,
-        repo_dir=repo_dir,
-        repo_index=repo_index,
-        base_sha=base_sha,
-    )
+    # Base-revision files are served through one cat-file pipe for the job,
+    # and head-revision snippets are sliced from a shared line store.
+    def extract_impacts(object_reader, loader):
+        with object_reader, LineStore(loader=loader) as line_store:
+            return find_impacts_with_confidence_and_context(
+                changed_symbols=changed_symbols,
+                symbol_graph=symbol_graph,
+                repo_dir=repo_dir,
+                repo_index=repo_index,
+                base_sha=diff_base,
+                callers=callers,
+                definitions=definitions,
+                object_reader=object_reader,
+                line_store=line_store,
+                changed_ids=changed_ids,
+            )
 
-    # ---- Phase 5: LLM explanations (PARALLELIZED) ----
-    def process_impact(impact):
-        # Optional: Add gate logic here (e.g. only explain Medium/High)
-        explanation = explain_impact(
+    impacts = None
+    if file_reader:
+        try:
+            impacts = extract_impacts(
+                file_reader,
+                lambda path: file_reader.read_file(commit_sha, os.path.relpath(path, repo_dir)),
+            )
+        except requests.RequestException as e:
+            # The diff and merge base from the API still hold; only file reads move
+            logger.warning(f"Contents API failed, falling back to a checkout: {e}")
+            repo_dir, object_mode = acquire_checkout()
+            git_args = auth_args(token) if object_mode else []
+
+    if impacts is None:
+        object_reader = GitObjectReader(repo_dir, git_args)
+        loader = None
+        if object_mode:
+            # The diff already fetched both sides of every changed file; batch in
+            # the callers' files so snippets do not lazy-fetch one blob at a time.
+            caller_files = {
+                site[0] for sid in changed_ids for site in callers.get(sid, [])
+            }
+            head_blobs = list_python_blobs(repo_dir, commit_sha)
+            prefetch_blobs(repo_dir, token, commit_sha, [head_blobs[f] for f in caller_files if f in head_blobs])
+            loader = lambda path: object_reader.read_object(f"{commit_sha}:{os.path.relpath(path, repo_dir)}")
+        impacts = extract_impacts(object_reader, loader)
+
+    # Callers of callers, with decaying confidence
+    reverse_csr = build_reverse_call_csr(symbol_graph, repo_index)
+    transitive_impacts = find_transitive_impacts(changed_ids, reverse_csr)
+
+    # ---- Phase 5: LLM explanations (SCHEDULED) ----
+    # Runs on the process-wide LLM loop; rate is bounded globally by the
+    # Redis token bucket, and each PR gets a token budget and a deadline.
+    def impact_kwargs(impact):
+        return dict(
             changed_symbol=impact["symbol"],
             before_code=impact["before_code"],
             after_code=impact["after_code"],
             impacted_file=impact["file"],
             call_site_code=impact["call_site_code"],
         )
-        impact["explanation"] = explanation
-        return impact
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {executor.submit(process_impact, impact): impact for impact in impacts}
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                logger.error(f"LLM generation failed: {e}")
+    def batch_kwargs(batch):
+        first = batch[0]
+        return dict(
+            changed_symbol=first["symbol"],
+            before_code=first["before_code"],
+            after_code=first["after_code"],
+            call_sites=[(impact["file"], impact["call_site_code"]) for impact in batch],
+        )
 
-    # ---- Rendering ----
-    summary = summarize_diff(diff)
+    async def process_impact(impact):
+        impact["explanation"] = await explain_impact_async(**impact_kwargs(impact))
 
-    if changed_symbols:
-        summary += "\nChanged symbols:\n"
-        for kind, name in set(changed_symbols):
-            summary += f"- {kind}: {name}\n"
+    async def process_batch(batch):
+        explanations = await explain_impacts_batch_async(**batch_kwargs(batch))
+        dropped = []
+        for impact, explanation in zip(batch, explanations):
+            if explanation:
+                impact["explanation"] = explanation
+            else:
+                dropped.append(impact)
+        # Dropped from the structured answer; each is asked for on its own,
+        # as a follow-up task charged to the same budget.
+        prompts = [impact_prompt(**impact_kwargs(impact)) for impact in dropped]
+        hits = await asyncio.to_thread(explanation_cache_hits, prompts)
+        return [make_task([impact], prompt, hit) for impact, prompt, hit in zip(dropped, prompts, hits)]
 
-    if impacts:
-        summary += "\nImpacted files:\n"
-        for r in impacts:
-            summary += (
-                f"- {r['file']} "
-                f"(symbol: {r['symbol']}, confidence: {r['label']})\n"
-            )
-            if r.get("explanation"):
-                summary += f"  ↳ {r['explanation']}\n"
+    def task_prompt(batch):
+        # A lone call site keeps the single-impact prompt and its cache entries
+        if len(batch) == 1:
+            return impact_prompt(**impact_kwargs(batch[0]))
+        return batch_prompt(**batch_kwargs(batch))
 
+    def make_task(batch, prompt, cached):
+        run = partial(process_impact, batch[0]) if len(batch) == 1 else partial(process_batch, batch)
+        # Low-confidence impacts only get whatever budget the rest leave
+        tier = 0 if batch[0]["label"] == "Low" else 1
+        score = max(impact["score"] for impact in batch)
+        # Cached answers cost nothing, so they never count against the budget
+        cost = 0 if cached else prompt_cost(prompt)
+        return LLMTask(priority=(tier, score), cost=cost, run=run, impacts=batch)
+
+    batches = []
+    if LLM_BATCH_EXPLAIN:
+        groups = {}
+        for impact in impacts:
+            key = (impact["symbol_id"], impact["label"] == "Low")
+            groups.setdefault(key, []).append(impact)
+        for group in groups.values():
+            first = group[0]
+            sites = [(impact["file"], impact["call_site_code"]) for impact in group]
+            start = 0
+            for sites_batch in batch_call_sites(first["before_code"], first["after_code"], sites):
+                batches.append(group[start:start + len(sites_batch)])
+                start += len(sites_batch)
+    else:
+        batches = [[impact] for impact in impacts]
+
+    prompts = [task_prompt(batch) for batch in batches]
+    hits = explanation_cache_hits(prompts)
+    tasks = [make_task(*args) for args in zip(batches, prompts, hits)]
+
+    def render(unexplained=0, pending=False):
+        return render_summary(diff, changed_symbols, impacts, transitive_impacts, unexplained, pending)
+
+    llm_stats = {}
+    if tasks:
+        check_current(repo, pr_number, head_sha)
+        future = run_async(run_scheduled(tasks))
+        if on_progress:
+            # Structure is known now; explanations stream in below
+            on_progress(render(pending=True))
+        while True:
+            try:
+                llm_stats = future.result(timeout=COMMENT_EDIT_INTERVAL)
+                break
+            except FutureTimeoutError:
+                try:
+                    check_current(repo, pr_number, head_sha)
+                except JobSuperseded:
+                    # Stop spending LLM budget on a head nobody will read
+                    future.cancel()
+                    raise
+                if on_progress:
+                    on_progress(render(pending=True))
+    unexplained = llm_stats.get("over_budget", 0) + llm_stats.get("past_deadline", 0)
+
+    # ---- Rendering ----
+    summary = render(unexplained)
     cache_set(summary_cache_key, summary, ttl=3600)
     
     return summary
\ No newline at end of file
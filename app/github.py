@@ -1,22 +1,113 @@
 import requests
 import os
+import time
+import random
 import logging
+import threading
+from datetime import datetime
+from urllib.parse import quote
+from requests.adapters import HTTPAdapter
 from app.github_auth import generate_jwt
+from app.cache import cache_get, cache_set
 
-GITHUB_API = "https://api.github.com"
+# Overridable so a local fake server can stand in for GitHub
+GITHUB_API = os.getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_POOL_SIZE = int(os.getenv("GITHUB_POOL_SIZE", 10))
+GITHUB_TIMEOUT = 30
+GITHUB_MAX_RETRIES = int(os.getenv("GITHUB_MAX_RETRIES", 3))
+# Rate-limit waits longer than this fail fast instead of tying up the worker
+GITHUB_MAX_BACKOFF = int(os.getenv("GITHUB_MAX_BACKOFF", 60))
+# Mint a new installation token this long before the cached one expires
+TOKEN_REFRESH_MARGIN = 300
+ETAG_TTL = 24 * 3600
+# Hidden marker that identifies Prism's own review comment on a PR
+COMMENT_MARKER = "<!-- prism-review -->"
+COMMENT_ID_TTL = 30 * 24 * 3600
+# Minimum seconds between edits of a progressive comment
+COMMENT_EDIT_INTERVAL = float(os.getenv("COMMENT_EDIT_INTERVAL", 5))
 logger = logging.getLogger(__name__)
 
-def post_pr_comment(repo: str, pr_number: int, body: str):
-    url = f"{GITHUB_API}/repos/{repo}/issues/{pr_number}/comments"
-    token = get_github_token(repo)
+# One keep-alive pool per process, shared by every GitHub call
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=GITHUB_POOL_SIZE, pool_maxsize=GITHUB_POOL_SIZE)
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+
+_installation_ids = {}
+_installation_tokens = {}
+_token_lock = threading.Lock()
+
+def rate_limit_delay(response, attempt: int) -> float | None:
+    """Seconds to wait before retrying a rate-limited response, or None if it is not one."""
+    if response.status_code not in (403, 429):
+        return None
+
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        return float(retry_after)
+
+    # Primary rate limit: wait for the window to reset
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        reset = int(response.headers.get("X-RateLimit-Reset", 0))
+        return max(reset - time.time(), 1)
+
+    # Secondary limits do not always send headers
+    if "rate limit" in response.text.lower():
+        return min(GITHUB_MAX_BACKOFF, 5 * 2 ** attempt) * (1 + random.random() / 2)
+
+    return None
+
+def github_request(method: str, path: str, token: str, accept: str = "application/vnd.github+json", **kwargs):
+    """Send a request on the shared session, backing off on rate limits.
+
+    `path` is relative to GITHUB_API. Extra kwargs go to Session.request.
+    """
+    url = f"{GITHUB_API}{path}"
     headers = {
         "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github+json",
+        "Accept": accept,
+        **kwargs.pop("headers", {}),
     }
+    kwargs.setdefault("timeout", GITHUB_TIMEOUT)
+
+    for attempt in range(GITHUB_MAX_RETRIES + 1):
+        response = session.request(method, url, headers=headers, **kwargs)
+        delay = rate_limit_delay(response, attempt)
+        if delay is None or attempt == GITHUB_MAX_RETRIES or delay > GITHUB_MAX_BACKOFF:
+            return response
+
+        logger.warning(
+            "GitHub rate limited, backing off",
+            extra={"url": url, "status": response.status_code, "delay": round(delay, 1)},
+        )
+        response.close()
+        time.sleep(delay)
 
-    response = requests.post(
-        url,
-        headers=headers,
+def github_get_json(path: str, token: str, params: dict | None = None):
+    """GET with If-None-Match, so unchanged resources come back as a free 304."""
+    etag_key = f"etag:{path}:{sorted((params or {}).items())}"
+    cached = cache_get(etag_key)
+    headers = {"If-None-Match": cached["etag"]} if cached else {}
+
+    response = github_request("GET", path, token, params=params, headers=headers)
+    if response.status_code == 304 and cached:
+        return cached["body"]
+
+    response.raise_for_status()
+    body = response.json()
+    etag = response.headers.get("ETag")
+    if etag:
+        cache_set(etag_key, {"etag": etag, "body": body}, ttl=ETAG_TTL)
+    return body
+
+def post_pr_comment(repo: str, pr_number: int, body: str) -> int:
+    path = f"/repos/{repo}/issues/{pr_number}/comments"
+    token = get_github_token(repo)
+
+    response = github_request(
+        "POST",
+        path,
+        token,
         json={"body": body},
     )
     logger.info("Posted PR comment", extra={"repo": repo, "pr": pr_number})
@@ -24,55 +115,209 @@ def post_pr_comment(repo: str, pr_number: int, body: str):
     if response.status_code >= 300:
         logger.error(
             "GitHub API error",
-            extra={"status": response.status_code, "url": url},
+            extra={"status": response.status_code, "url": path},
+        )
+        raise RuntimeError(
+            f"GitHub API error {response.status_code}: {response.text}"
+        )
+    return response.json()["id"]
+
+def update_pr_comment(repo: str, comment_id: int, body: str) -> bool:
+    """Edit a comment in place; False if it no longer exists."""
+    path = f"/repos/{repo}/issues/comments/{comment_id}"
+    response = github_request("PATCH", path, get_github_token(repo), json={"body": body})
+    if response.status_code == 404:
+        return False
+    if response.status_code >= 300:
+        logger.error(
+            "GitHub API error",
+            extra={"status": response.status_code, "url": path},
         )
         raise RuntimeError(
             f"GitHub API error {response.status_code}: {response.text}"
         )
+    return True
+
+def find_prism_comment(repo: str, pr_number: int) -> int | None:
+    """ID of the PR comment carrying COMMENT_MARKER, if Prism already posted one."""
+    path = f"/repos/{repo}/issues/{pr_number}/comments"
+    token = get_github_token(repo)
+    page = 1
+    while True:
+        response = github_request("GET", path, token, params={"per_page": 100, "page": page})
+        response.raise_for_status()
+        comments = response.json()
+        for comment in comments:
+            if COMMENT_MARKER in (comment.get("body") or ""):
+                return comment["id"]
+        if len(comments) < 100:
+            return None
+        page += 1
+
+def upsert_pr_comment(repo: str, pr_number: int, body: str) -> int:
+    """Edit Prism's existing comment on the PR, or post one. Returns its ID."""
+    body = f"{COMMENT_MARKER}\n{body}"
+    id_key = f"prism:comment:{repo}:{pr_number}"
+    comment_id = cache_get(id_key) or find_prism_comment(repo, pr_number)
+
+    if comment_id and update_pr_comment(repo, comment_id, body):
+        logger.info("Updated PR comment", extra={"repo": repo, "pr": pr_number})
+    else:
+        # Never posted, or deleted by someone since
+        comment_id = post_pr_comment(repo, pr_number, body)
+    cache_set(id_key, comment_id, ttl=COMMENT_ID_TTL)
+    return comment_id
+
+class ProgressiveComment:
+    """One PR comment that is posted early and then edited as results arrive.
+
+    Edits are at least COMMENT_EDIT_INTERVAL apart and skipped when the body
+    has not changed; the final publish always goes out.
+    """
+
+    def __init__(self, repo: str, pr_number: int, min_interval: float = COMMENT_EDIT_INTERVAL):
+        self.repo = repo
+        self.pr_number = pr_number
+        self.min_interval = min_interval
+        self._last_body = None
+        self._last_sent = 0.0
+
+    def publish(self, body: str, final: bool = False):
+        if body == self._last_body:
+            return
+        if not final and time.monotonic() - self._last_sent < self.min_interval:
+            return
+        try:
+            upsert_pr_comment(self.repo, self.pr_number, body)
+        except (RuntimeError, requests.RequestException) as e:
+            if final:
+                raise
+            # A missed intermediate edit is superseded by the next one
+            logger.warning(f"Progressive comment update failed: {e}")
+            return
+        self._last_body = body
+        self._last_sent = time.monotonic()
 
 def get_installation_id(jwt_token: str, repo: str) -> int:
     owner , repo_name = repo.split("/")
-    url = f"{GITHUB_API}/repos/{owner}/{repo_name}/installation"
-    headers = {
-        "Authorization": f"Bearer {jwt_token}",
-        "Accept": "application/vnd.github+json",
-    }
-    response = requests.get(url, headers=headers)
+    path = f"/repos/{owner}/{repo_name}/installation"
+    response = github_request("GET", path, jwt_token)
     if response.status_code != 200:
         logger.error(
             "Failed to get installation ID",
-            extra={"status": response.status_code, "url": url},
+            extra={"status": response.status_code, "url": path},
         )
         raise RuntimeError(
             f"Failed to get installation ID: {response.status_code} {response.text}"
         )
-    response.raise_for_status()
     installation_data = response.json()
     installation_id = installation_data["id"]
     return installation_id
 
-def get_installation_token(jwt_token: str, installation_id: int) -> str:
-    url = f"{GITHUB_API}/app/installations/{installation_id}/access_tokens"
-    headers = {
-        "Authorization": f"Bearer {jwt_token}",
-        "Accept": "application/vnd.github+json",
-    }
-    response = requests.post(url, headers=headers)
+class InstallationTokenError(RuntimeError):
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+def request_installation_token(jwt_token: str, installation_id: int) -> dict:
+    path = f"/app/installations/{installation_id}/access_tokens"
+    response = github_request("POST", path, jwt_token)
     if response.status_code != 201:
         logger.error(
             "Failed to get installation token",
-            extra={"status": response.status_code, "url": url},
+            extra={"status": response.status_code, "url": path},
         )
-        raise RuntimeError(
-            f"Failed to get installation token: {response.status_code} {response.text}"
+        raise InstallationTokenError(
+            f"Failed to get installation token: {response.status_code} {response.text}",
+            response.status_code,
         )
-    response.raise_for_status()
-    token_data = response.json()
-    installation_token = token_data["token"]
-    return installation_token
+    return response.json()
+
+def get_installation_token(jwt_token: str, installation_id: int) -> str:
+    return request_installation_token(jwt_token, installation_id)["token"]
 
 def get_github_token(repo:str) -> str:
-    jwt_token = generate_jwt()
-    installation_id = get_installation_id(jwt_token, repo)
-    installation_token = get_installation_token(jwt_token, installation_id)
-    return installation_token
\ No newline at end of file
+    """Installation token for `repo`, minted at most once per expiry window per process."""
+    with _token_lock:
+        installation_id = _installation_ids.get(repo)
+        cached = _installation_tokens.get(installation_id)
+        if cached and cached[1] - TOKEN_REFRESH_MARGIN > time.time():
+            return cached[0]
+
+        jwt_token = generate_jwt()
+        for attempt in range(2):
+            if installation_id is None:
+                installation_id = get_installation_id(jwt_token, repo)
+                _installation_ids[repo] = installation_id
+            try:
+                token_data = request_installation_token(jwt_token, installation_id)
+                break
+            except InstallationTokenError as e:
+                # A reinstalled app gets a new installation id; look it up again once
+                if attempt or e.status not in (401, 404):
+                    raise
+                logger.warning("Installation gone, looking it up again", extra={"repo": repo, "installation": installation_id})
+                _installation_ids.pop(repo, None)
+                _installation_tokens.pop(installation_id, None)
+                installation_id = None
+        expires_at = datetime.fromisoformat(token_data["expires_at"].replace("Z", "+00:00")).timestamp()
+        _installation_tokens[installation_id] = (token_data["token"], expires_at)
+        logger.info("Minted installation token", extra={"repo": repo, "installation": installation_id})
+        return token_data["token"]
+
+def iter_compare_diff(repo: str, base_sha: str, head_sha: str, token: str):
+    """Stream the unified diff between two commits from the compare API.
+
+    Raises requests.HTTPError when GitHub refuses, e.g. for a diff too large
+    to render, so callers can fall back to a local checkout.
+    """
+    path = f"/repos/{repo}/compare/{base_sha}...{head_sha}"
+    with github_request("GET", path, token, accept="application/vnd.github.diff", stream=True) as response:
+        response.raise_for_status()
+        # Split on "\n" only; str.splitlines would also break on \r and \f
+        for line in response.iter_lines(delimiter=b"\n"):
+            yield line.decode("utf-8", errors="replace")
+
+def get_merge_base(repo: str, base_sha: str, head_sha: str, token: str) -> str:
+    """The commit a three-dot compare diffs from, as the PR's Files tab does."""
+    data = github_get_json(f"/repos/{repo}/compare/{base_sha}...{head_sha}", token, params={"per_page": 1})
+    return data["merge_base_commit"]["sha"]
+
+class GitHubFileReader:
+    """Reads files at a commit through the contents API, for jobs with no checkout.
+
+    Mirrors the GitObjectReader.show interface.
+    """
+
+    def __init__(self, repo: str, token: str):
+        self.repo = repo
+        self.token = token
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read_file(self, ref: str, file_path: str) -> bytes | None:
+        key = (ref, file_path)
+        if key in self._files:
+            return self._files[key]
+
+        path = f"/repos/{self.repo}/contents/{quote(file_path)}"
+        response = github_request("GET", path, self.token, accept="application/vnd.github.raw", params={"ref": ref})
+        if response.status_code == 404:
+            data = None
+        else:
+            response.raise_for_status()
+            data = response.content
+        self._files[key] = data
+        return data
+
+    def show(self, commit_sha: str, file_path: str) -> str:
+        data = self.read_file(commit_sha, file_path)
+        return "" if data is None else data.decode("utf-8", errors="replace")
+
+    def close(self):
+        self._files.clear()
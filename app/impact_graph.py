@@ -0,0 +1,179 @@
+import os
+import bisect
+from array import array
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, List
+
+from app.confidence import compute_confidence, confidence_label
+
+TRANSITIVE_MAX_DEPTH = int(os.getenv("TRANSITIVE_MAX_DEPTH", 3))
+TRANSITIVE_NODE_BUDGET = int(os.getenv("TRANSITIVE_NODE_BUDGET", 500))
+TRANSITIVE_DECAY = float(os.getenv("TRANSITIVE_DECAY", 0.6))
+
+@dataclass
+class CSRGraph:
+    """Adjacency in compressed sparse row form over integer node ids.
+
+    The edges of node i are targets[offsets[i]:offsets[i + 1]], and
+    edge_lines holds the call line for each edge.
+    """
+    nodes: List[str]
+    ids: Dict[str, int]
+    offsets: array
+    targets: array
+    edge_lines: array
+
+    @classmethod
+    def from_edges(cls, nodes, edges):
+        # edges: (source id, target id, line)
+        counts = array("l", [0]) * (len(nodes) + 1)
+        for source, _, _ in edges:
+            counts[source + 1] += 1
+        for i in range(len(nodes)):
+            counts[i + 1] += counts[i]
+
+        targets = array("l", [0]) * len(edges)
+        edge_lines = array("l", [0]) * len(edges)
+        cursor = array("l", counts)
+        for source, target, line in edges:
+            pos = cursor[source]
+            targets[pos] = target
+            edge_lines[pos] = line
+            cursor[source] += 1
+
+        return cls(
+            nodes=nodes,
+            ids={name: i for i, name in enumerate(nodes)},
+            offsets=counts,
+            targets=targets,
+            edge_lines=edge_lines,
+        )
+
+    def edges(self, node_id):
+        start, end = self.offsets[node_id], self.offsets[node_id + 1]
+        return zip(self.targets[start:end], self.edge_lines[start:end])
+
+def module_node_id(file_path):
+    # Calls made at module level have no enclosing symbol.
+    return f"{file_path}:module:"
+
+def _enclosing_finders(repo_index):
+    finders = {}
+    for path, fi in repo_index.items():
+        spans = sorted((sym.start, sym.end, f"{path}:{sym.kind}:{sym.name}") for sym in fi.symbols)
+        finders[path] = ([span[0] for span in spans], spans)
+    return finders
+
+def _enclosing_symbol(finder, line):
+    starts, spans = finder
+    # Spans nest, so the closest start that still covers the line is innermost.
+    i = bisect.bisect_right(starts, line) - 1
+    while i >= 0:
+        start, end, sid = spans[i]
+        if end >= line:
+            return sid
+        i -= 1
+    return None
+
+def build_reverse_call_csr(symbol_graph, repo_index) -> CSRGraph:
+    """Reverse call graph: callee symbol -> enclosing symbol of each call site."""
+    finders = _enclosing_finders(repo_index)
+    nodes = []
+    ids = {}
+
+    def node_id(name):
+        if name not in ids:
+            ids[name] = len(nodes)
+            nodes.append(name)
+        return ids[name]
+
+    edges = []
+    for caller_file, callees in symbol_graph.items():
+        finder = finders.get(caller_file)
+        for sid, meta in callees.items():
+            callee = node_id(sid)
+            seen = set()
+            for line in meta["lines"]:
+                enclosing = _enclosing_symbol(finder, line) if finder else None
+                caller = node_id(enclosing or module_node_id(caller_file))
+                # Recursion does not add impact
+                if caller != callee and caller not in seen:
+                    seen.add(caller)
+                    edges.append((callee, caller, line))
+
+    return CSRGraph.from_edges(nodes, edges)
+
+def find_transitive_impacts(
+    changed_ids,
+    reverse_csr: CSRGraph,
+    max_depth: int = TRANSITIVE_MAX_DEPTH,
+    node_budget: int = TRANSITIVE_NODE_BUDGET,
+    decay: float = TRANSITIVE_DECAY,
+):
+    """Callers of callers (depth >= 2) of the changed symbols, bounded by depth and budget.
+
+    Direct callers are reported by find_impacts_with_confidence_and_context.
+    """
+    nodes = reverse_csr.nodes
+    files = {}
+
+    def file_of(node):
+        if node not in files:
+            files[node] = nodes[node].rsplit(":", 2)[0]
+        return files[node]
+
+    # (file, seed) -> [depth, call count, first line, via node]
+    found = {}
+    direct = set()
+    # Keyed by (node, seed): seeds sharing a caller each explore past it.
+    # The budget caps the total across seeds.
+    visited = set()
+    queue = deque()
+    # Deduplicated in input order, so results do not depend on the hash seed
+    for sid in dict.fromkeys(changed_ids):
+        node = reverse_csr.ids.get(sid)
+        if node is not None and (node, node) not in visited:
+            visited.add((node, node))
+            queue.append((node, node, 0, None))
+
+    while queue:
+        node, seed, depth, via = queue.popleft()
+        if depth >= max_depth:
+            continue
+
+        for caller, line in reverse_csr.edges(node):
+            key = (file_of(caller), seed)
+            if depth == 0:
+                direct.add(key)
+            elif key not in direct:
+                entry = found.get(key)
+                if entry is None or depth + 1 < entry[0]:
+                    found[key] = [depth + 1, 1, line, via]
+                elif depth + 1 == entry[0]:
+                    entry[1] += 1
+
+            if (caller, seed) in visited or len(visited) >= node_budget:
+                continue
+            visited.add((caller, seed))
+            queue.append((caller, seed, depth + 1, caller if via is None else via))
+
+    # Scored once per impacted file, not per edge
+    impacts = []
+    for (file_path, seed), (depth, count, line, via) in found.items():
+        symbol = nodes[seed].rsplit(":", 1)[-1]
+        score = compute_confidence(file_path, symbol, count) * decay ** (depth - 1)
+        impacts.append({
+            "file": file_path,
+            "symbol": symbol,
+            "symbol_id": nodes[seed],
+            "via": nodes[via].rsplit(":", 1)[-1],
+            "depth": depth,
+            "call_count": count,
+            "call_site_line": line,
+            "score": score,
+            "label": confidence_label(score),
+        })
+
+    impacts.sort(key=lambda x: x["score"], reverse=True)
+    return impacts
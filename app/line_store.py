@@ -0,0 +1,100 @@
+import os
+import mmap
+import threading
+from array import array
+from collections import OrderedDict
+
+LINE_STORE_MAX_BYTES = int(os.getenv("LINE_STORE_MAX_BYTES", 64 * 1024 * 1024))
+# Files at least this large are mapped instead of read into memory.
+LINE_STORE_MMAP_THRESHOLD = 1024 * 1024
+
+class LineStore:
+    """Per-job LRU of file contents plus line offsets, so snippets are slices."""
+
+    def __init__(
+        self,
+        max_bytes: int = LINE_STORE_MAX_BYTES,
+        mmap_threshold: int = LINE_STORE_MMAP_THRESHOLD,
+        loader=None,
+    ):
+        self.max_bytes = max_bytes
+        self.mmap_threshold = mmap_threshold
+        # Optional callable path -> bytes | None, used instead of the filesystem
+        self.loader = loader
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read(self, path: str):
+        if self.loader is not None:
+            buf = self.loader(path) or b""
+            return buf, len(buf)
+
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            if size >= self.mmap_threshold:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), 0
+            buf = f.read()
+            return buf, len(buf)
+
+    def _load(self, path: str):
+        buf, cost = self._read(path)
+
+        offsets = array("q", [0])
+        pos = buf.find(b"\n")
+        while pos != -1:
+            offsets.append(pos + 1)
+            pos = buf.find(b"\n", pos + 1)
+        if offsets[-1] == len(buf):
+            offsets.pop()
+        if not buf:
+            offsets = array("q")
+
+        cost += offsets.itemsize * len(offsets)
+        return buf, offsets, cost
+
+    def _get(self, path: str):
+        entry = self._entries.get(path)
+        if entry is not None:
+            self._entries.move_to_end(path)
+            return entry
+
+        entry = self._load(path)
+        self._entries[path] = entry
+        self._size += entry[2]
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            _, (buf, _, cost) = self._entries.popitem(last=False)
+            self._size -= cost
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+        return entry
+
+    def get_lines(self, path: str, start_line: int, end_line: int) -> str:
+        """Return lines start_line..end_line (1-based, inclusive, clamped)."""
+        if self.loader is None and not os.path.exists(path):
+            return ""
+
+        with self._lock:
+            buf, offsets, _ = self._get(path)
+            start = max(1, start_line)
+            end = min(len(offsets), end_line)
+            if start > end:
+                return ""
+            stop = offsets[end] if end < len(offsets) else len(buf)
+            chunk = buf[offsets[start - 1]:stop]
+
+        return "\n".join(chunk.decode("utf-8", errors="replace").splitlines())
+
+    def close(self):
+        with self._lock:
+            for buf, _, _ in self._entries.values():
+                if isinstance(buf, mmap.mmap):
+                    buf.close()
+            self._entries.clear()
+            self._size = 0
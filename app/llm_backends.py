@@ -0,0 +1,152 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from google import genai
+from google.genai import errors, types
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# gemini | stub | record | replay
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", 0))
+LLM_STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", 0))
+LLM_STUB_SEED = int(os.getenv("LLM_STUB_SEED", 0))
+LLM_RECORD_DIR = os.getenv("LLM_RECORD_DIR", "llm-recordings")
+# Replay sleeps for the recorded latency, to reproduce slow jobs
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "0") == "1"
+
+class LLMBackend:
+    """One way of turning a (system, user) prompt pair into text.
+
+    `model_id` keys the explanation cache, and `rate_limited` says whether
+    calls draw from the shared Redis token bucket.
+    """
+    model_id = None
+    rate_limited = False
+
+    async def generate(self, system_prompt: str, user_prompt: str) -> str:
+        raise NotImplementedError
+
+class GeminiBackend(LLMBackend):
+    rate_limited = True
+
+    def __init__(self, model: str = GEMINI_MODEL):
+        self.model_id = model
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self) -> genai.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+            return self._client
+
+    async def generate(self, system_prompt: str, user_prompt: str) -> str:
+        response = await self.client().aio.models.generate_content(
+            model=self.model_id,
+            contents=user_prompt,
+            config=types.GenerateContentConfig(
+                system_instruction=system_prompt,
+                tools=[types.Tool(google_search=types.GoogleSearch())],
+                response_modalities=["TEXT"]
+            )
+        )
+        return response.text.strip() if response.text else ""
+
+class StubBackend(LLMBackend):
+    """Offline answers derived from the prompt hash, for benchmarks and CI.
+
+    Latency and failures come from a seeded generator, so a run is
+    repeatable. Failures are 503s and go through the normal retry path.
+    """
+    model_id = "stub"
+
+    def __init__(
+        self,
+        latency_ms: float = LLM_STUB_LATENCY_MS,
+        error_rate: float = LLM_STUB_ERROR_RATE,
+        seed: int = LLM_STUB_SEED,
+    ):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    async def generate(self, system_prompt: str, user_prompt: str) -> str:
+        if self.latency_ms:
+            # Exponential around the mean, like real request latency
+            await asyncio.sleep(self._random.expovariate(1000 / self.latency_ms))
+        if self._random.random() < self.error_rate:
+            raise errors.ServerError(503, {"error": {"message": "stub backend failure", "status": "UNAVAILABLE"}})
+
+        digest = hashlib.sha256((system_prompt + user_prompt).encode("utf-8")).hexdigest()[:12]
+        if "JSON array" in user_prompt:
+            # Batched prompts number their call sites from 1
+            sites = len(re.findall(r"^Call site \d+", user_prompt, re.MULTILINE))
+            return json.dumps([
+                {"id": i, "explanation": f"Stub explanation {digest}-{i}."}
+                for i in range(1, sites + 1)
+            ])
+        return f"Stub explanation {digest}."
+
+class RecordReplayBackend(LLMBackend):
+    """Stores each prompt and answer as a JSON file, or serves them back.
+
+    In "record" mode calls go to `inner` and are written to `directory`;
+    in "replay" mode nothing leaves the process and an unseen prompt is an error.
+    """
+
+    def __init__(self, inner: LLMBackend, directory: str, mode: str):
+        self.inner = inner
+        self.directory = directory
+        self.mode = mode
+        self.model_id = inner.model_id
+        self.rate_limited = inner.rate_limited and mode == "record"
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, system_prompt: str, user_prompt: str) -> str:
+        key = json.dumps([self.model_id, system_prompt, user_prompt])
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    async def generate(self, system_prompt: str, user_prompt: str) -> str:
+        path = self.path_for(system_prompt, user_prompt)
+        if self.mode == "replay":
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    recording = json.load(f)
+            except FileNotFoundError:
+                raise LookupError(f"No recorded LLM response for this prompt ({os.path.basename(path)})")
+            if LLM_REPLAY_LATENCY:
+                await asyncio.sleep(recording["latency"])
+            return recording["response"]
+
+        start = time.perf_counter()
+        response = await self.inner.generate(system_prompt, user_prompt)
+        recording = {
+            "model": self.model_id,
+            "system_prompt": system_prompt,
+            "user_prompt": user_prompt,
+            "response": response,
+            "latency": round(time.perf_counter() - start, 3),
+        }
+        # Write then rename, so a concurrent replay never reads half a file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(recording, f, indent=2)
+        os.replace(tmp_path, path)
+        return response
+
+def make_backend(name: str = LLM_BACKEND) -> LLMBackend:
+    if name == "gemini":
+        return GeminiBackend()
+    if name == "stub":
+        return StubBackend()
+    if name in ("record", "replay"):
+        return RecordReplayBackend(GeminiBackend(), LLM_RECORD_DIR, name)
+    raise ValueError(f"Unknown LLM_BACKEND {name!r}")
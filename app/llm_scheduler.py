@@ -0,0 +1,84 @@
+import os
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List
+
+logger = logging.getLogger(__name__)
+
+# Per PR: estimated prompt + answer tokens, and seconds for the whole LLM phase
+LLM_PR_TOKEN_BUDGET = int(os.getenv("LLM_PR_TOKEN_BUDGET", 60000))
+LLM_PR_DEADLINE = float(os.getenv("LLM_PR_DEADLINE", 120))
+LLM_PR_CONCURRENCY = int(os.getenv("LLM_PR_CONCURRENCY", 5))
+
+@dataclass
+class LLMTask:
+    # Higher runs first; compared as tuples, e.g. (tier, score)
+    priority: tuple
+    cost: int
+    # May return follow-up LLMTasks for impacts it left unexplained
+    run: Callable[[], Awaitable]
+    impacts: List[dict] = field(default_factory=list)
+
+async def run_scheduled(
+    tasks: List[LLMTask],
+    token_budget: int = LLM_PR_TOKEN_BUDGET,
+    deadline: float = LLM_PR_DEADLINE,
+    concurrency: int = LLM_PR_CONCURRENCY,
+) -> dict:
+    """Run tasks in priority order until the token budget or deadline runs out.
+
+    Tasks that do not fit the remaining budget are skipped (a cheaper one
+    further down may still run); anything not finished by the deadline is
+    cancelled. Follow-ups a task returns run right after it, under the same
+    budget and deadline. Returns impact counts per outcome.
+    """
+    loop = asyncio.get_running_loop()
+    stop_at = loop.time() + deadline
+    queue = iter(sorted(tasks, key=lambda task: task.priority, reverse=True))
+    remaining = token_budget
+    stats = {"explained": 0, "failed": 0, "over_budget": 0, "past_deadline": 0}
+
+    async def execute(task):
+        nonlocal remaining
+        if loop.time() >= stop_at:
+            stats["past_deadline"] += len(task.impacts)
+            return
+        if task.cost > remaining:
+            stats["over_budget"] += len(task.impacts)
+            return
+        remaining -= task.cost
+        try:
+            follow_ups = await task.run() or []
+        except asyncio.CancelledError:
+            stats["past_deadline"] += len(task.impacts)
+            raise
+        except Exception as e:
+            logger.error(f"LLM generation failed: {e}")
+            stats["failed"] += len(task.impacts)
+            return
+        stats["explained"] += len(task.impacts) - sum(len(f.impacts) for f in follow_ups)
+        for follow_up in follow_ups:
+            await execute(follow_up)
+
+    async def worker():
+        # Workers share one iterator, so each task is taken exactly once
+        for task in queue:
+            await execute(task)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(concurrency, 1))]
+    try:
+        await asyncio.wait(workers, timeout=deadline)
+    finally:
+        # Also reached when the whole phase is cancelled, e.g. by a newer push
+        for running in workers:
+            running.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    for task in queue:
+        stats["past_deadline"] += len(task.impacts)
+
+    logger.info(
+        "LLM phase finished",
+        extra={**stats, "tokens_used": token_budget - remaining},
+    )
+    return stats
@@ -1,6 +1,122 @@
-from app.api_service import generate
+import os
+import json
+import asyncio
+import difflib
+import hashlib
+import logging
+from app.api_service import LLM_OUTPUT_TOKENS, estimate_tokens, generate_async, get_backend, run_async
+from app.cache import cache_get, cache_get_many, cache_set
 
-def explain_impact(
+logger = logging.getLogger(__name__)
+
+# Bump when post-processing of responses changes; prompt text is hashed as is.
+PROMPT_VERSION = 2
+EXPLANATION_TTL = int(os.getenv("EXPLANATION_TTL", 30 * 24 * 3600))
+# Call sites of one changed symbol share a request, up to this many prompt tokens
+BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", 6000))
+# Keeps each answer short enough that the JSON is not cut off
+BATCH_MAX_SITES = int(os.getenv("LLM_BATCH_MAX_SITES", 15))
+# Caps on each code block in a prompt, in estimated tokens
+MAX_CHANGE_TOKENS = int(os.getenv("LLM_MAX_CHANGE_TOKENS", 1500))
+MAX_CALL_SITE_TOKENS = int(os.getenv("LLM_MAX_CALL_SITE_TOKENS", 300))
+DIFF_CONTEXT_LINES = 3
+
+SYSTEM_PROMPT = (
+    "You are an AI code review assistant.\n"
+    "You are NOT allowed to:\n"
+    "- invent new dependencies\n"
+    "- assume bugs without evidence\n"
+    "- mention files or functions not provided\n\n"
+    "You MUST:\n"
+    "- explain potential impact conservatively\n"
+    "- base reasoning only on the provided code\n"
+    "- be concise (3–5 sentences max)\n"
+)
+
+def trim_to_tokens(code: str, max_tokens: int) -> str:
+    """Keep whole leading lines of `code` within roughly `max_tokens`."""
+    if estimate_tokens(code) <= max_tokens:
+        return code
+    lines = code.splitlines()
+    kept = []
+    used = 0
+    for line in lines:
+        used += estimate_tokens(line + "\n")
+        if used > max_tokens:
+            break
+        kept.append(line)
+    kept.append(f"# ... {len(lines) - len(kept)} more lines trimmed")
+    return "\n".join(kept)
+
+def change_section(before_code: str, after_code: str) -> str:
+    """The changed symbol as a unified diff with its signature, not two full bodies."""
+    after_lines = after_code.splitlines()
+    if not before_code.strip():
+        return f"""Changed function (new in this pull request):
+```python
+{trim_to_tokens(after_code, MAX_CHANGE_TOKENS)}
+```"""
+
+    diff = list(difflib.unified_diff(
+        before_code.splitlines(),
+        after_lines,
+        n=DIFF_CONTEXT_LINES,
+        lineterm="",
+    ))[2:]  # drop the ---/+++ file headers
+    if not diff:
+        return f"""Changed function (body unchanged, e.g. decorators or surrounding lines moved):
+```python
+{trim_to_tokens(after_code, MAX_CHANGE_TOKENS)}
+```"""
+
+    signature = after_lines[0] if after_lines else ""
+    diff_text = trim_to_tokens("\n".join(diff), MAX_CHANGE_TOKENS)
+    return f"""Changed function signature:
+```python
+{signature}
+```
+
+Change (unified diff, {DIFF_CONTEXT_LINES} lines of context):
+```diff
+{diff_text}
+```"""
+
+def prompt_cost(user_prompt: str) -> int:
+    """Estimated tokens one request spends, prompt plus answer."""
+    return estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(user_prompt) + LLM_OUTPUT_TOKENS
+
+def explanation_cache_key(system_prompt: str, user_prompt: str) -> str:
+    # The rendered prompt covers symbol, before/after code, file and call site
+    payload = json.dumps([PROMPT_VERSION, get_backend().model_id, system_prompt, user_prompt])
+    return "explain:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def explanation_cache_hits(user_prompts: list) -> list:
+    """Whether each prompt already has a cached answer, in one MGET."""
+    keys = [explanation_cache_key(SYSTEM_PROMPT, prompt) for prompt in user_prompts]
+    return [cached is not None for cached in cache_get_many(keys)]
+
+async def cached_generate_async(system_prompt: str, user_prompt: str, validate=None) -> str:
+    """generate_async(), reusing any earlier answer to a byte-identical prompt.
+
+    With `validate`, only answers it accepts are cached.
+    """
+    key = explanation_cache_key(system_prompt, user_prompt)
+    # Redis calls are blocking; keep them off the shared LLM loop
+    cached = await asyncio.to_thread(cache_get, key)
+    if cached is not None:
+        logger.info("Explanation cache hit")
+        return cached
+
+    response = (await generate_async(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+    )).strip()
+    # Empty or malformed answers are usually transient; ask again next time
+    if response and (validate is None or validate(response)):
+        await asyncio.to_thread(cache_set, key, response, ttl=EXPLANATION_TTL)
+    return response
+
+def impact_prompt(
     *,
     changed_symbol: str,
     before_code: str,
@@ -8,35 +124,16 @@ def explain_impact(
     impacted_file: str,
     call_site_code: str,
 ) -> str:
-    system_prompt = (
-        "You are an AI code review assistant.\n"
-        "You are NOT allowed to:\n"
-        "- invent new dependencies\n"
-        "- assume bugs without evidence\n"
-        "- mention files or functions not provided\n\n"
-        "You MUST:\n"
-        "- explain potential impact conservatively\n"
-        "- base reasoning only on the provided code\n"
-        "- be concise (3–5 sentences max)\n"
-    )
+    return f"""A function named `{changed_symbol}` has changed in a pull request.
 
-    user_prompt = f"""A function named `{changed_symbol}` has changed in a pull request.
+{change_section(before_code, after_code)}
 
-Changed function BEFORE:
-```python
-{before_code}
-```
-
-Changed function AFTER:
-```python
-{after_code}
-```
 This function is called in the following file:
 `{impacted_file}`
 
 Call site:
 ```python
-{call_site_code}
+{trim_to_tokens(call_site_code, MAX_CALL_SITE_TOKENS)}
 ```
 
 Explain:
@@ -46,10 +143,107 @@ why this change might affect `{impacted_file}`
 what the developer should double-check
 
 do NOT assume this is a bug unless it clearly is"""
-    response = generate(
-    system_prompt=system_prompt,
-    user_prompt=user_prompt,
+
+async def explain_impact_async(**kwargs) -> str:
+    return await cached_generate_async(SYSTEM_PROMPT, impact_prompt(**kwargs))
+
+def explain_impact(**kwargs) -> str:
+    return run_async(explain_impact_async(**kwargs)).result()
+
+def batch_call_sites(before_code: str, after_code: str, call_sites: list) -> list:
+    """Split (impacted_file, call_site_code) pairs into groups that fit one request each."""
+    shared = estimate_tokens(change_section(before_code, after_code))
+    budget = max(BATCH_TOKEN_BUDGET - shared, 1)
+
+    batches = []
+    current = []
+    used = 0
+    for site in call_sites:
+        cost = estimate_tokens(site[0]) + min(estimate_tokens(site[1]), MAX_CALL_SITE_TOKENS)
+        if current and (used + cost > budget or len(current) >= BATCH_MAX_SITES):
+            batches.append(current)
+            current = []
+            used = 0
+        current.append(site)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+def parse_batch_response(response: str) -> dict:
+    """Map call-site number -> explanation from the model's JSON answer."""
+    text = response.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[-1].rsplit("```", 1)[0]
+    try:
+        items = json.loads(text)
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    explanations = {}
+    for item in items:
+        if isinstance(item, dict) and isinstance(item.get("explanation"), str):
+            explanations[item.get("id")] = item["explanation"].strip()
+    return explanations
+
+def batch_prompt(
+    *,
+    changed_symbol: str,
+    before_code: str,
+    after_code: str,
+    call_sites: list,
+) -> str:
+    blocks = []
+    first_seen = {}
+    for i, (impacted_file, call_site_code) in enumerate(call_sites, start=1):
+        # Identical snippets (copied or generated code) are sent once
+        if call_site_code in first_seen:
+            blocks.append(f"Call site {i}, in `{impacted_file}`: same code as call site {first_seen[call_site_code]}.\n")
+            continue
+        first_seen[call_site_code] = i
+        blocks.append(f"""Call site {i}, in `{impacted_file}`:
+```python
+{trim_to_tokens(call_site_code, MAX_CALL_SITE_TOKENS)}
+```
+""")
+    sites = "\n".join(blocks)
+
+    return f"""A function named `{changed_symbol}` has changed in a pull request.
+
+{change_section(before_code, after_code)}
+
+This function is called at the following {len(call_sites)} call sites:
+
+{sites}
+For each call site, explain:
+
+why this change might affect that file
+
+what the developer should double-check
+
+do NOT assume this is a bug unless it clearly is
+
+Answer with only a JSON array, one object per call site, like
+[{{"id": 1, "explanation": "..."}}]"""
+
+async def explain_impacts_batch_async(**kwargs) -> list:
+    """Explain several call sites of one changed symbol in a single request.
+
+    `call_sites` is a list of (impacted_file, call_site_code). Returns one
+    explanation per call site, or None where the answer could not be parsed.
+    """
+    ids = range(1, len(kwargs["call_sites"]) + 1)
+    response = await cached_generate_async(
+        SYSTEM_PROMPT,
+        batch_prompt(**kwargs),
+        # Prose or a truncated array would otherwise be served back for the TTL
+        validate=lambda text: all(parse_batch_response(text).get(i) for i in ids),
     )
+    explanations = parse_batch_response(response)
+    return [explanations.get(i) for i in ids]
+
+def explain_impacts_batch(**kwargs) -> list:
+    return run_async(explain_impacts_batch_async(**kwargs)).result()
 
-    return response.strip()
-    
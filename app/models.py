@@ -1,5 +1,21 @@
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field
+from typing import Dict, List
+from array import array
+from itertools import repeat
+import gc
+import struct
+import sys
+import zlib
+
+GRAPH_MAGIC = b"PRSG"
+GRAPH_FORMAT_VERSION = 1
+_IMPORT_TYPES = ("import", "from")
+_GRAPH_COLUMNS = (
+    "paths", "import_counts", "symbol_counts", "imports",
+    "symbol_names", "symbol_kinds", "symbol_starts", "symbol_ends",
+    "callers", "callee_counts",
+    "callee_files", "callee_kinds", "callee_names", "line_counts", "lines",
+)
 
 @dataclass
 class Symbol:
@@ -14,6 +30,17 @@ class FileIndex:
     path: str
     imports: List[str]
     symbols: List[Symbol]
+    calls: List[dict] = field(default_factory=list)
+
+@dataclass
+class DiffStats:
+    # Head-side paths in diff order; deleted files only appear in old_files
+    files: List[str] = field(default_factory=list)
+    old_files: List[str] = field(default_factory=list)
+    added: int = 0
+    removed: int = 0
+    # path -> sorted, merged [start, end] runs of added lines (head numbering)
+    changed_lines: Dict[str, List[List[int]]] = field(default_factory=dict)
     
 def serialize_repo_index(repo_index: FileIndex) -> dict:
     return {
@@ -49,6 +76,25 @@ def deserialize_repo_index(data: dict) -> FileIndex:
         )
     return index
 
+def serialize_file_index(fi: FileIndex) -> dict:
+    # Path-free so the entry can be shared by every file with the same blob.
+    return {
+        "imports": fi.imports,
+        "symbols": [[sym.name, sym.kind, sym.start, sym.end] for sym in fi.symbols],
+        "calls": [[call["name"], call["line"]] for call in fi.calls],
+    }
+
+def deserialize_file_index(path: str, data: dict) -> FileIndex:
+    return FileIndex(
+        path=path,
+        imports=data["imports"],
+        symbols=[
+            Symbol(name=name, kind=kind, file=path, start=start, end=end)
+            for name, kind, start, end in data["symbols"]
+        ],
+        calls=[{"name": name, "line": line} for name, line in data["calls"]],
+    )
+
 def serialize_symbol_graph(symbol_graph):
     return {
         file: dict(callees)
@@ -61,3 +107,159 @@ def deserialize_symbol_graph(data):
         for file, callees in data.items()
     }
 
+def encode_graph(repo_index, symbol_graph) -> bytes:
+    """Pack repo_index and symbol_graph into the versioned binary cache format.
+
+    Layout: magic, version byte, then a zlib stream holding a NUL-separated
+    string table followed by int32 columns (see _GRAPH_COLUMNS). Every path,
+    name and kind is interned once and referenced by id; -1 encodes None.
+    """
+    strings = {}
+
+    def sid(value):
+        if value is None:
+            return -1
+        i = strings.get(value)
+        if i is None:
+            i = strings[value] = len(strings)
+        return i
+
+    cols = {name: array("i") for name in _GRAPH_COLUMNS}
+    for path, fi in repo_index.items():
+        cols["paths"].append(sid(path))
+        cols["import_counts"].append(len(fi.imports))
+        cols["symbol_counts"].append(len(fi.symbols))
+        for imp in fi.imports:
+            names = imp.get("names")
+            cols["imports"].extend((
+                _IMPORT_TYPES.index(imp["type"]),
+                sid(imp["module"]),
+                imp["level"],
+                sid(imp.get("alias")),
+                -1 if names is None else len(names),
+            ))
+            for name, alias in names or ():
+                cols["imports"].append(sid(name))
+                cols["imports"].append(sid(alias))
+        for sym in fi.symbols:
+            cols["symbol_names"].append(sid(sym.name))
+            cols["symbol_kinds"].append(sid(sym.kind))
+            cols["symbol_starts"].append(sym.start)
+            cols["symbol_ends"].append(sym.end)
+
+    for caller, callees in symbol_graph.items():
+        cols["callers"].append(sid(caller))
+        cols["callee_counts"].append(len(callees))
+        for callee, meta in callees.items():
+            # count always equals len(lines), so only the lines are stored
+            file, kind, name = callee.rsplit(":", 2)
+            cols["callee_files"].append(sid(file))
+            cols["callee_kinds"].append(sid(kind))
+            cols["callee_names"].append(sid(name))
+            cols["line_counts"].append(len(meta["lines"]))
+            cols["lines"].extend(meta["lines"])
+
+    blob = "\0".join(strings).encode("utf-8")
+    header = struct.pack(f"<{len(_GRAPH_COLUMNS) + 1}I", len(blob), *(len(cols[name]) for name in _GRAPH_COLUMNS))
+    body = b"".join(_le_bytes(cols[name]) for name in _GRAPH_COLUMNS)
+    return GRAPH_MAGIC + bytes([GRAPH_FORMAT_VERSION]) + zlib.compress(header + blob + body, 6)
+
+def decode_graph(data: bytes):
+    """Inverse of encode_graph. Raises ValueError for an unknown format."""
+    if data[:4] != GRAPH_MAGIC or data[4] != GRAPH_FORMAT_VERSION:
+        raise ValueError("Unsupported graph cache format")
+
+    # Nothing decoded here can form a cycle; pausing the collector avoids
+    # repeated full collections while tens of thousands of objects are built.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _decode_graph_payload(zlib.decompress(data[5:]))
+    except (zlib.error, struct.error) as e:
+        raise ValueError(f"Corrupt graph cache entry: {e}") from e
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+def _decode_graph_payload(payload: bytes):
+    lengths = struct.unpack_from(f"<{len(_GRAPH_COLUMNS) + 1}I", payload)
+    pos = 4 * len(lengths)
+    strings = payload[pos:pos + lengths[0]].decode("utf-8").split("\0")
+    pos += lengths[0]
+
+    cols = {}
+    for name, length in zip(_GRAPH_COLUMNS, lengths[1:]):
+        col = array("i")
+        col.frombytes(payload[pos:pos + 4 * length])
+        if sys.byteorder == "big":
+            col.byteswap()
+        cols[name] = col
+        pos += 4 * length
+
+    def string(i):
+        return None if i < 0 else strings[i]
+
+    lookup = strings.__getitem__
+    paths = list(map(lookup, cols["paths"]))
+    symbol_names = list(map(lookup, cols["symbol_names"]))
+    symbol_kinds = list(map(lookup, cols["symbol_kinds"]))
+    symbol_starts = cols["symbol_starts"].tolist()
+    symbol_ends = cols["symbol_ends"].tolist()
+    take = iter(cols["imports"]).__next__
+
+    repo_index = {}
+    sym_pos = 0
+    for path, n_imports, n_symbols in zip(paths, cols["import_counts"], cols["symbol_counts"]):
+        imports = []
+        for _ in range(n_imports):
+            import_type, module, level, alias, n_names = (take(), take(), take(), take(), take())
+            imp = {
+                "type": _IMPORT_TYPES[import_type],
+                "module": string(module),
+                "level": level,
+            }
+            if n_names >= 0:
+                imp["names"] = [[string(take()), string(take())] for _ in range(n_names)]
+            else:
+                imp["alias"] = string(alias)
+            imports.append(imp)
+
+        end = sym_pos + n_symbols
+        symbols = list(map(
+            Symbol,
+            symbol_names[sym_pos:end],
+            symbol_kinds[sym_pos:end],
+            repeat(path, n_symbols),
+            symbol_starts[sym_pos:end],
+            symbol_ends[sym_pos:end],
+        ))
+        sym_pos = end
+        repo_index[path] = FileIndex(path=path, imports=imports, symbols=symbols)
+
+    callee_ids = [
+        f"{strings[f]}:{strings[k]}:{strings[n]}"
+        for f, k, n in zip(cols["callee_files"], cols["callee_kinds"], cols["callee_names"])
+    ]
+    lines = cols["lines"].tolist()
+    line_counts = cols["line_counts"]
+
+    symbol_graph = {}
+    edge = 0
+    line_pos = 0
+    for caller, n_callees in zip(map(lookup, cols["callers"]), cols["callee_counts"]):
+        callees = {}
+        for _ in range(n_callees):
+            n_lines = line_counts[edge]
+            callee_lines = lines[line_pos:line_pos + n_lines]
+            callees[callee_ids[edge]] = {"count": n_lines, "lines": callee_lines}
+            line_pos += n_lines
+            edge += 1
+        symbol_graph[caller] = callees
+
+    return repo_index, symbol_graph
+
+def _le_bytes(col: array) -> bytes:
+    if sys.byteorder == "big":
+        col = array(col.typecode, col)
+        col.byteswap()
+    return col.tobytes()
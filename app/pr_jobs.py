@@ -0,0 +1,56 @@
+import os
+import logging
+from app.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# A push landing while an earlier job for the PR is still pending waits this
+# long before starting, so a burst of pushes runs once
+PR_DEBOUNCE_SECONDS = int(os.getenv("PR_DEBOUNCE_SECONDS", 10))
+PR_JOB_TTL = 7 * 24 * 3600
+# Outlives any real job; bounds how long a crashed job counts as pending
+PR_PENDING_TTL = 3600
+
+# Clears the pending job only if it is still this one
+FINISH_JOB_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+_finish_job = redis_client.register_script(FINISH_JOB_SCRIPT)
+
+class JobSuperseded(Exception):
+    """A newer push to the PR made this job's head SHA stale."""
+
+def _head_key(repo: str, pr_number: int) -> str:
+    return f"prism:head:{repo}:{pr_number}"
+
+def _job_key(repo: str, pr_number: int) -> str:
+    return f"prism:job:{repo}:{pr_number}"
+
+def record_head(repo: str, pr_number: int, head_sha: str, task_id: str) -> str | None:
+    """Mark `head_sha` as the PR's latest head and `task_id` as its pending job.
+
+    Returns the id of the still-pending job this one replaces, if any.
+    """
+    pipe = redis_client.pipeline()
+    pipe.set(_head_key(repo, pr_number), head_sha, ex=PR_JOB_TTL)
+    pipe.set(_job_key(repo, pr_number), task_id, ex=PR_PENDING_TTL, get=True)
+    _, previous = pipe.execute()
+    return previous
+
+def finish_job(repo: str, pr_number: int, task_id: str):
+    """Clear `task_id` as the PR's pending job, unless a newer push replaced it."""
+    _finish_job(keys=[_job_key(repo, pr_number)], args=[task_id])
+
+def check_current(repo: str, pr_number: int, head_sha: str | None):
+    """Raise JobSuperseded if a newer head than `head_sha` was pushed.
+
+    Jobs queued without a head SHA are never considered stale.
+    """
+    if not head_sha:
+        return
+    latest = redis_client.get(_head_key(repo, pr_number))
+    if latest and latest != head_sha:
+        raise JobSuperseded(f"{repo}#{pr_number} moved from {head_sha[:12]} to {latest[:12]}")
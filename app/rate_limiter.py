@@ -0,0 +1,63 @@
+import asyncio
+import random
+import logging
+from app.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Two buckets (requests and tokens) refilled continuously from Redis server
+# time, so every worker on every host draws from the same budget.
+# Returns 0 when the request may go ahead, else milliseconds to wait.
+TOKEN_BUCKET_SCRIPT = """
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local cost = math.min(tonumber(ARGV[3]), tpm)
+local clock = redis.call('TIME')
+local now = clock[1] * 1000 + math.floor(clock[2] / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'r', 't', 'ts')
+local r = tonumber(state[1]) or rpm
+local t = tonumber(state[2]) or tpm
+local elapsed = math.max(now - (tonumber(state[3]) or now), 0)
+r = math.min(rpm, r + elapsed * rpm / 60000)
+t = math.min(tpm, t + elapsed * tpm / 60000)
+
+local wait = 0
+if r >= 1 and t >= cost then
+    r = r - 1
+    t = t - cost
+else
+    wait = math.ceil(math.max((1 - r) * 60000 / rpm, (cost - t) * 60000 / tpm))
+end
+
+redis.call('HSET', KEYS[1], 'r', r, 't', t, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], 120000)
+return wait
+"""
+
+class RedisTokenBucket:
+    """Requests-per-minute and tokens-per-minute limits shared through Redis."""
+
+    def __init__(self, key: str, requests_per_minute: int, tokens_per_minute: int):
+        self.key = key
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def try_acquire(self, tokens: int) -> float:
+        """Take one request and `tokens` if available; else seconds until they will be."""
+        wait_ms = self._script(
+            keys=[self.key],
+            args=[self.requests_per_minute, self.tokens_per_minute, tokens],
+        )
+        return int(wait_ms) / 1000
+
+    async def acquire(self, tokens: int):
+        while True:
+            # Off the event loop, so one Redis round-trip does not stall every call in flight
+            wait = await asyncio.to_thread(self.try_acquire, tokens)
+            if wait <= 0:
+                return
+            logger.debug("Rate limiter full, waiting", extra={"key": self.key, "wait": wait})
+            # Jitter so waiters across workers do not retry in lockstep
+            await asyncio.sleep(wait * (1 + random.random() / 4))
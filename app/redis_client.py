@@ -8,4 +8,10 @@ redis_client = redis.Redis(
     port = int(os.getenv("REDIS_PORT", 6379)),
     decode_responses=True
 )
+# Same server, raw bytes in and out, for binary cache values.
+redis_binary_client = redis.Redis(
+    host = os.getenv("REDIS_HOST", "redis"),
+    port = int(os.getenv("REDIS_PORT", 6379)),
+    decode_responses=False
+)
 logger.info("Redis client initialized")
\ No newline at end of file
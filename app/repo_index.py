@@ -1,7 +1,24 @@
-from typing import Dict
-from app.static_analysis import parse_code, extract_symbols, extract_imports
-from app.models import Symbol, FileIndex
+from typing import Dict, List
+from functools import partial
+# Celery's fork of multiprocessing; unlike it, lets daemonic prefork children start pools
+import billiard
+from billiard.exceptions import WorkerLostError
+from app.static_analysis import parse_code, extract_all, reset_parser
+from app.models import Symbol, FileIndex, serialize_file_index, deserialize_file_index
+from app.cache import cache_get_many, cache_set_many
+import subprocess
 import os 
+import logging
+
+logger = logging.getLogger(__name__)
+
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", os.cpu_count() or 1))
+# Below this many files, process pool startup costs more than it saves.
+INDEX_PARALLEL_MIN_FILES = int(os.getenv("INDEX_PARALLEL_MIN_FILES", 200))
+INDEX_CHUNK_SIZE = 64
+# Bump when extraction output changes so stale per-blob entries are ignored.
+FILE_INDEX_CACHE_VERSION = 2
+FILE_INDEX_TTL = int(os.getenv("FILE_INDEX_TTL", 7 * 24 * 3600))
 
 def index_file(repo_dir: str, file_path: str) -> FileIndex:
     full_path = os.path.join(repo_dir, file_path)
@@ -9,10 +26,13 @@ def index_file(repo_dir: str, file_path: str) -> FileIndex:
     if not full_path.endswith(".py"):
         return None
     
-    code = open(full_path).read()
-    tree = parse_code(code)
-    symbols_raw = extract_symbols(tree)
-    imports = extract_imports(tree)
+    with open(full_path, "rb") as f:
+        source = f.read()
+    return index_source(file_path, source)
+
+def index_source(file_path: str, source: bytes) -> FileIndex:
+    tree = parse_code(source)
+    symbols_raw = extract_all(tree)
     
     symbols = []
     
@@ -36,18 +56,185 @@ def index_file(repo_dir: str, file_path: str) -> FileIndex:
     
     return FileIndex(
         path=file_path,
-        imports=imports,
-        symbols=symbols
+        imports=symbols_raw["imports"],
+        symbols=symbols,
+        calls=symbols_raw["calls"],
     )
 
-def build_repo_index(repo_dir:str) -> Dict[str, FileIndex]:
-    index = {}
+def symbols_by_kind(file_index: FileIndex) -> dict:
+    functions = []
+    classes = []
+    for sym in file_index.symbols:
+        entry = {
+            "name": sym.name,
+            "start_line": sym.start,
+            "end_line": sym.end,
+        }
+        if sym.kind == "function":
+            functions.append(entry)
+        elif sym.kind == "class":
+            classes.append(entry)
+
+    return {
+        "functions": functions,
+        "classes": classes,
+    }
+
+def list_python_files(repo_dir: str) -> List[str]:
+    paths = []
     for root, _, files in os.walk(repo_dir):
         for file in files:
             if file.endswith(".py"):
-                rel_path = os.path.relpath(os.path.join(root, file), repo_dir)
-                file_index = index_file(repo_dir, rel_path)
-                if file_index:
-                    index[rel_path] = file_index
-                    
-    return index
\ No newline at end of file
+                paths.append(os.path.relpath(os.path.join(root, file), repo_dir))
+    return paths
+
+def _init_index_worker():
+    # Each pool process owns its own tree-sitter parser.
+    reset_parser()
+
+def _index_item(repo_dir: str | None, item):
+    # Items are paths under repo_dir, or (path, source) pairs when repo_dir is None.
+    if repo_dir is None:
+        path, source = item
+        return path, index_source(path, source)
+    return item, index_file(repo_dir, item)
+
+def _index_chunk(repo_dir: str | None, items: list) -> List[tuple]:
+    packed = []
+    for item in items:
+        path, file_index = _index_item(repo_dir, item)
+        if file_index:
+            # Symbol.file always equals the path, so it is dropped in transit.
+            packed.append((path, serialize_file_index(file_index)))
+    return packed
+
+def _index_serial(repo_dir: str | None, items: list) -> Dict[str, FileIndex]:
+    index = {}
+    for item in items:
+        path, file_index = _index_item(repo_dir, item)
+        if file_index:
+            index[path] = file_index
+    return index
+
+def _index_parallel(repo_dir: str | None, items: list, workers: int) -> Dict[str, FileIndex]:
+    chunks = [
+        items[i:i + INDEX_CHUNK_SIZE]
+        for i in range(0, len(items), INDEX_CHUNK_SIZE)
+    ]
+    index = {}
+    with billiard.Pool(processes=workers, initializer=_init_index_worker) as pool:
+        for packed in pool.imap(partial(_index_chunk, repo_dir), chunks):
+            for path, data in packed:
+                index[path] = deserialize_file_index(path, data)
+    return index
+
+def _index_items(repo_dir: str | None, items: list, workers: int | None) -> Dict[str, FileIndex]:
+    workers = INDEX_WORKERS if workers is None else workers
+    if workers <= 1 or len(items) < INDEX_PARALLEL_MIN_FILES:
+        return _index_serial(repo_dir, items)
+
+    try:
+        return _index_parallel(repo_dir, items, workers)
+    except (OSError, WorkerLostError) as e:
+        # e.g. no /dev/shm for the pool's semaphores, or a crashed pool process
+        logger.warning(f"Parallel indexing failed, falling back to serial: {e}")
+        return _index_serial(repo_dir, items)
+
+def index_files(repo_dir: str, paths: List[str], workers: int | None = None) -> Dict[str, FileIndex]:
+    return _index_items(repo_dir, paths, workers)
+
+def index_sources(sources: List[tuple], workers: int | None = None) -> Dict[str, FileIndex]:
+    """Index in-memory (path, bytes) pairs, e.g. blobs read straight from git."""
+    return _index_items(None, sources, workers)
+
+def build_repo_index(repo_dir:str, workers: int | None = None) -> Dict[str, FileIndex]:
+    paths = list_python_files(repo_dir)
+    index = index_files(repo_dir, paths, workers)
+    logger.info(f"Indexed {len(index)} files", extra={"files": len(index)})
+    return index
+
+def list_python_blobs(repo_dir: str, rev: str = "HEAD") -> Dict[str, str]:
+    result = subprocess.run(
+        ["git", "ls-tree", "-r", "-z", rev],
+        cwd=repo_dir,
+        check=True,
+        capture_output=True,
+    )
+    blobs = {}
+    for entry in result.stdout.decode("utf-8", errors="surrogateescape").split("\0"):
+        if not entry:
+            continue
+        meta, path = entry.split("\t", 1)
+        mode, obj_type, sha = meta.split(" ")
+        # Skip submodules and symlinks
+        if obj_type != "blob" or mode == "120000":
+            continue
+        if path.endswith(".py"):
+            blobs[path] = sha
+    return blobs
+
+def file_index_cache_key(blob_sha: str) -> str:
+    return f"fileindex:v{FILE_INDEX_CACHE_VERSION}:{blob_sha}"
+
+def _lookup_cached(blobs: Dict[str, str]):
+    paths = list(blobs)
+    cached = cache_get_many([file_index_cache_key(blobs[path]) for path in paths])
+
+    index = {}
+    misses = []
+    for path, data in zip(paths, cached):
+        if data is None:
+            misses.append(path)
+        else:
+            index[path] = deserialize_file_index(path, data)
+    return index, misses
+
+def _store_fresh(blobs: Dict[str, str], index: Dict[str, FileIndex], fresh: Dict[str, FileIndex], misses: List[str]):
+    cache_set_many(
+        {
+            file_index_cache_key(blobs[path]): serialize_file_index(fi)
+            for path, fi in fresh.items()
+        },
+        ttl=FILE_INDEX_TTL,
+    )
+    index.update(fresh)
+
+    logger.info(
+        f"Indexed {len(index)} files ({len(misses)} parsed, {len(index) - len(fresh)} from cache)",
+        extra={"files": len(index), "parsed": len(misses)},
+    )
+    # Keep tree order so symbol resolution does not depend on cache hits
+    return {path: index[path] for path in blobs if path in index}
+
+def build_repo_index_cached(repo_dir: str, rev: str = "HEAD", workers: int | None = None) -> Dict[str, FileIndex]:
+    """Assemble the repo index from per-blob cache entries, parsing only unseen blobs."""
+    blobs = list_python_blobs(repo_dir, rev)
+    index, misses = _lookup_cached(blobs)
+    fresh = index_files(repo_dir, misses, workers)
+    return _store_fresh(blobs, index, fresh, misses)
+
+def build_repo_index_from_objects(
+    git_dir: str,
+    rev: str,
+    object_reader,
+    prefetch=None,
+    workers: int | None = None,
+) -> Dict[str, FileIndex]:
+    """Like build_repo_index_cached, but reads blobs from the object store of a
+    (possibly bare, blobless) repository instead of a checked out tree.
+
+    `prefetch` is called with the SHAs of uncached blobs before they are read,
+    so a partial clone can fetch them in one batch instead of one at a time.
+    """
+    blobs = list_python_blobs(git_dir, rev)
+    index, misses = _lookup_cached(blobs)
+    if misses and prefetch is not None:
+        prefetch([blobs[path] for path in misses])
+
+    sources = []
+    for path in misses:
+        source = object_reader.read_object(blobs[path])
+        if source is not None:
+            sources.append((path, source))
+    fresh = index_sources(sources, workers)
+    return _store_fresh(blobs, index, fresh, misses)
@@ -0,0 +1,138 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from bisect import bisect_right
+from functools import lru_cache
+from app.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Route each repo to the worker whose mirror and in-process caches are warm for it
+WORKER_AFFINITY = os.getenv("WORKER_AFFINITY", "1") == "1"
+WORKER_HEARTBEAT_INTERVAL = 5
+# A worker missing heartbeats for this long leaves the ring
+WORKER_TTL = 3 * WORKER_HEARTBEAT_INTERVAL
+RING_REPLICAS = 64
+# Consumed by every worker; also where overflow and orphaned jobs go
+SHARED_QUEUE = "celery"
+WORKERS_KEY = "prism:workers"
+
+def worker_queue(worker: str) -> str:
+    return f"prism.worker.{worker}"
+
+def _load_key(worker: str) -> str:
+    return f"prism:worker:{worker}"
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+class HashRing:
+    """Consistent hash ring; when a worker joins or leaves, only its share of repos moves."""
+
+    def __init__(self, nodes, replicas: int = RING_REPLICAS):
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str) -> str | None:
+        if not self._points:
+            return None
+        return self._nodes[bisect_right(self._points, _hash(key)) % len(self._points)]
+
+@lru_cache(maxsize=8)
+def _ring(workers: tuple) -> HashRing:
+    return HashRing(workers)
+
+def live_workers() -> tuple:
+    return tuple(sorted(redis_client.zrangebyscore(WORKERS_KEY, time.time() - WORKER_TTL, "+inf")))
+
+def is_saturated(worker: str) -> bool:
+    """Jobs the worker holds plus jobs waiting in its queue fill the worker's pool."""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hmget(_load_key(worker), "reserved", "concurrency")
+    pipe.llen(worker_queue(worker))
+    (reserved, concurrency), queued = pipe.execute()
+    if concurrency is None:
+        return True
+    return int(reserved or 0) + queued >= int(concurrency)
+
+def queue_for_repo(repo: str) -> str:
+    home = _ring(live_workers()).node_for(repo)
+    if home is None:
+        return SHARED_QUEUE
+    if is_saturated(home):
+        logger.info("Home worker saturated, overflowing", extra={"repo": repo, "worker": home})
+        return SHARED_QUEUE
+    return worker_queue(home)
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """Celery router: jobs whose first argument is a repo go to its home worker."""
+    if not WORKER_AFFINITY or not args or options.get("queue"):
+        return None
+    try:
+        return {"queue": queue_for_repo(args[0])}
+    except Exception as e:
+        # Routing is an optimisation; never fail to enqueue because of it
+        logger.warning(f"Affinity routing failed, using the shared queue: {e}")
+        return {"queue": SHARED_QUEUE}
+
+# ---- Worker side ----
+
+def register_worker(worker: str, concurrency: int):
+    pipe = redis_client.pipeline()
+    pipe.hset(_load_key(worker), mapping={"reserved": 0, "concurrency": concurrency})
+    pipe.expire(_load_key(worker), WORKER_TTL)
+    pipe.zadd(WORKERS_KEY, {worker: time.time()})
+    pipe.execute()
+
+def unregister_worker(worker: str):
+    pipe = redis_client.pipeline()
+    pipe.zrem(WORKERS_KEY, worker)
+    pipe.delete(_load_key(worker))
+    pipe.execute()
+    # Jobs nobody will consume now; leaving the ring already re-homes new ones
+    reassign_queue(worker)
+
+def reassign_queue(worker: str) -> int:
+    """Move jobs still queued for `worker` to the shared queue."""
+    moved = 0
+    while redis_client.rpoplpush(worker_queue(worker), SHARED_QUEUE) is not None:
+        moved += 1
+    if moved:
+        logger.info(f"Moved {moved} queued jobs off departed worker {worker}")
+    return moved
+
+def reap_departed_workers():
+    """Drop workers that stopped heartbeating, and hand their queued jobs to the rest."""
+    cutoff = time.time() - WORKER_TTL
+    for worker in redis_client.zrangebyscore(WORKERS_KEY, "-inf", cutoff):
+        # Only the worker that removes the entry moves its queue
+        if redis_client.zrem(WORKERS_KEY, worker):
+            reassign_queue(worker)
+
+def start_heartbeat(worker: str, concurrency: int, reserved) -> threading.Event:
+    """Keep `worker` in the ring until the returned event is set.
+
+    `reserved()` counts the jobs the worker holds, running or about to run.
+    Each beat overwrites the last, so a crashed job cannot leave the count stuck.
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(WORKER_HEARTBEAT_INTERVAL):
+            try:
+                pipe = redis_client.pipeline()
+                pipe.zadd(WORKERS_KEY, {worker: time.time()})
+                pipe.hset(_load_key(worker), mapping={"reserved": reserved(), "concurrency": concurrency})
+                pipe.expire(_load_key(worker), WORKER_TTL)
+                pipe.execute()
+                reap_departed_workers()
+            except Exception as e:
+                logger.warning(f"Worker heartbeat failed: {e}")
+
+    threading.Thread(target=beat, name="worker-heartbeat", daemon=True).start()
+    return stop
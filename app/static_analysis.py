@@ -1,37 +1,76 @@
 from tree_sitter_languages import get_language, get_parser
 import os
+import re
+from bisect import bisect_left
+from app.models import DiffStats
 
 PY_LANGUAGE = get_language("python")
 parser = get_parser("python")
-def parse_code(code: str):
-    tree = parser.parse(code.encode("utf-8"))
+
+# Compiled once; tree-sitter matches these in C instead of a Python walk.
+SYMBOL_QUERY = PY_LANGUAGE.query("""
+(function_definition) @function
+(class_definition) @class
+""")
+IMPORT_QUERY = PY_LANGUAGE.query("""
+(import_statement) @import
+(import_from_statement) @import
+""")
+CALL_QUERY = PY_LANGUAGE.query("""
+(call) @call
+""")
+INDEX_QUERY = PY_LANGUAGE.query("""
+(function_definition) @function
+(class_definition) @class
+(import_statement) @import
+(import_from_statement) @import
+(call) @call
+""")
+
+def reset_parser():
+    global parser
+    parser = get_parser("python")
+
+def parse_code(code: str | bytes):
+    if isinstance(code, str):
+        code = code.encode("utf-8")
+    tree = parser.parse(code)
     return tree
 
 def walk(node):
-    yield node
-    for child in node.children:
-        yield from walk(child)
+    # Iterative pre-order walk; deep generated files cannot hit the recursion limit.
+    cursor = node.walk()
+    depth = 0
+    yield cursor.node
+    while True:
+        if cursor.goto_first_child():
+            depth += 1
+        else:
+            while depth > 0 and not cursor.goto_next_sibling():
+                cursor.goto_parent()
+                depth -= 1
+            if depth == 0:
+                return
+        yield cursor.node
+
+def symbol_entry(node):
+    name_node = node.child_by_field_name("name")
+    return {
+        "name": name_node.text.decode(),
+        "start_line": node.start_point[0]+1,
+        "end_line": node.end_point[0]+1,
+    }
 
 def extract_symbols(tree):
     functions = []
     classes = []
 
-    for node in walk(tree.root_node):
-        if node.type == "function_definition":
-            name_node = node.child_by_field_name("name")
-            functions.append({
-                "name": name_node.text.decode(),
-                "start_line": node.start_point[0]+1,
-                "end_line": node.end_point[0]+1,
-            })
+    for node, capture in SYMBOL_QUERY.captures(tree.root_node):
+        if capture == "function":
+            functions.append(symbol_entry(node))
 
-        elif node.type == "class_definition":
-            name_node = node.child_by_field_name("name")
-            classes.append({
-                "name": name_node.text.decode(),
-                "start_line": node.start_point[0]+1,
-                "end_line": node.end_point[0]+1,
-            })
+        elif capture == "class":
+            classes.append(symbol_entry(node))
 
     return {
         "functions": functions,
@@ -50,72 +89,130 @@ def extract_symbols(tree):
 
 #     return imports
 
-def extract_imports(tree):
+def imported_name(node):
+    # "x" -> ("x", None), "x as y" -> ("x", "y")
+    if node.type == "aliased_import":
+        return (
+            node.child_by_field_name("name").text.decode(),
+            node.child_by_field_name("alias").text.decode(),
+        )
+    return node.text.decode(), None
+
+def import_entries(node):
     imports = []
 
-    for node in walk(tree.root_node):
-        # 1. Handle "import foo, bar" and "import foo as f"
-        if node.type == "import_statement":
-            skip_next = False
-            for child in node.children:
-                # If we see "as", we must skip the NEXT child (the alias name)
-                if child.text.decode() == "as":
-                    skip_next = True
-                    continue
-                
-                if skip_next:
-                    skip_next = False
-                    continue
-
-                if child.type == "dotted_name":
-                    imports.append({
-                        "type": "import",
-                        "module": child.text.decode(),
-                        "level": 0,
-                    })
-
-        # 2. Handle "from ..." statements
-        elif node.type == "import_from_statement":
-            level = 0
-            module_from_clause = None
-            imported_names = [] 
-            seen_import_keyword = False
-
-            for child in node.children:
-                if child.type == ".":
-                    if not seen_import_keyword:
-                        level += 1
-                
+    # 1. Handle "import foo, bar" and "import foo as f"
+    if node.type == "import_statement":
+        for child in node.children_by_field_name("name"):
+            module, alias = imported_name(child)
+            imports.append({
+                "type": "import",
+                "module": module,
+                "level": 0,
+                "alias": alias,
+            })
+
+    # 2. Handle "from ..." statements
+    elif node.type == "import_from_statement":
+        level = 0
+        module_from_clause = None
+
+        module_node = node.child_by_field_name("module_name")
+        if module_node.type == "relative_import":
+            # "from ..foo import x": the dots are an import_prefix child
+            for child in module_node.children:
+                if child.type == "import_prefix":
+                    level = child.end_byte - child.start_byte
                 elif child.type == "dotted_name":
-                    if not seen_import_keyword:
-                        # "from foo.bar ..."
-                        module_from_clause = child.text.decode()
-                    else:
-                        # "... import x, y"
-                        imported_names.append(child.text.decode())
-                
-                elif child.text.decode() == "import":
-                    seen_import_keyword = True
-
-            # Resolution Logic
-            if module_from_clause:
-                # Case: "from foo import x" -> resolve "foo"
+                    module_from_clause = child.text.decode()
+        else:
+            module_from_clause = module_node.text.decode()
+
+        imported_names = [
+            list(imported_name(child))
+            for child in node.children_by_field_name("name")
+        ]
+        if any(child.type == "wildcard_import" for child in node.children):
+            imported_names.append(["*", None])
+
+        # Resolution Logic
+        if module_from_clause:
+            # Case: "from foo import x" -> resolve "foo"
+            imports.append({
+                "type": "from",
+                "module": module_from_clause,
+                "level": level,
+                "names": imported_names,
+            })
+        else:
+            # Case: "from .. import deep" -> resolve "deep"
+            for name, alias in imported_names:
                 imports.append({
                     "type": "from",
-                    "module": module_from_clause,
+                    "module": name,
                     "level": level,
+                    "alias": alias,
                 })
-            else:
-                # Case: "from .. import deep" -> resolve "deep"
-                for name in imported_names:
-                    imports.append({
-                        "type": "from",
-                        "module": name,
-                        "level": level,
-                    })
 
     return imports
 
+def extract_imports(tree):
+    imports = []
+
+    for node, _ in IMPORT_QUERY.captures(tree.root_node):
+        imports.extend(import_entries(node))
+
+    return imports
+
+def call_entry(node):
+    fn = node.child_by_field_name("function")
+    if fn is None:
+        return None
+
+    return {
+        "name": fn.text.decode(),
+        "line": node.start_point[0] + 1,
+    }
+
+def extract_function_calls(tree):
+    calls = []
+
+    for node, _ in CALL_QUERY.captures(tree.root_node):
+        call = call_entry(node)
+        if call:
+            calls.append(call)
+
+    return calls
+
+def extract_all(tree):
+    """Collect symbols, imports and call sites from a single query pass."""
+    functions = []
+    classes = []
+    imports = []
+    calls = []
+
+    for node, capture in INDEX_QUERY.captures(tree.root_node):
+        if capture == "call":
+            call = call_entry(node)
+            if call:
+                calls.append(call)
+
+        elif capture == "function":
+            functions.append(symbol_entry(node))
+
+        elif capture == "class":
+            classes.append(symbol_entry(node))
+
+        elif capture == "import":
+            imports.extend(import_entries(node))
+
+    return {
+        "functions": functions,
+        "classes": classes,
+        "imports": imports,
+        "calls": calls,
+    }
+
 def resolve_absolute_import(module, module_root):
     if not module:
         return None
@@ -179,42 +276,182 @@ def resolve_import(import_stmt, current_file, module_root):
             )
 
     return None
-def changed_files_from_diff(diff: str):
-    files = set()
-    for line in diff.splitlines():
-        if line.startswith("+++ b/"):
-            files.add(line[6:])
-    return list(files)
 
-def changed_lines_from_diff(diff: str):
-    changed = set()
-    current = None
+def detect_module_prefix(known_files) -> str:
+    # Index-based counterpart of dependency_graph.detect_module_root
+    if any(path.startswith("src/") for path in known_files):
+        return "src/"
+    return ""
+
+def module_file_in_index(parts, known_files):
+    base = "/".join(parts)
+    for candidate in (base + ".py", base + "/__init__.py"):
+        if candidate in known_files:
+            return candidate
+    return None
 
-    for line in diff.splitlines():
-        if line.startswith("@@"):
-            # @@ -a,b +c,d @@
-            hunk = line.split("+")[1].split(" ")[0]
-            current = int(hunk.split(",")[0])
+def import_module_parts(import_stmt, current_file, module_prefix=""):
+    """Path components of the module an import refers to, relative to the repo."""
+    module = import_stmt["module"]
+    level = import_stmt["level"]
+
+    if level > 0:
+        # Walk up `level` times from the importing file
+        base = current_file[:-len(".py")].split("/")[:-level]
+        if module:
+            base += module.split(".")
+        return base
+
+    if not module:
+        return None
+    prefix = module_prefix.rstrip("/").split("/") if module_prefix else []
+    return prefix + module.split(".")
+
+def resolve_import_in_index(import_stmt, current_file, known_files, module_prefix=""):
+    """Like resolve_import, but resolves against indexed paths instead of the disk."""
+    parts = import_module_parts(import_stmt, current_file, module_prefix)
+    if not parts:
+        return None
+
+    target = module_file_in_index(parts, known_files)
+    if target or import_stmt["level"] > 0:
+        return target
+
+    # Fall back to the top-level package, as resolve_absolute_import does
+    prefix_len = len(parts) - len(import_stmt["module"].split("."))
+    return module_file_in_index(parts[:prefix_len + 1], known_files)
 
-        elif line.startswith("+") and not line.startswith("+++"):
-            if current is not None:
-                changed.add(current)
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+def _diff_path(header: str):
+    path = header[4:].rstrip("\n").split("\t", 1)[0]
+    if path == "/dev/null":
+        return None
+    # Strip the a/ or b/ prefix
+    return path[2:]
+
+def parse_diff(lines) -> DiffStats:
+    """Single pass over unified diff lines (any iterable, e.g. a pipe).
+
+    Hunk line counts decide what is content, so added lines that happen to
+    start with "++" or "--" are never mistaken for file headers.
+    """
+    stats = DiffStats()
+    path = None
+    intervals = None
+    old_left = new_left = 0
+    current = 0
+
+    for line in lines:
+        if old_left > 0 or new_left > 0:
+            tag = line[:1]
+            if tag == "+":
+                if intervals is not None:
+                    if intervals and intervals[-1][1] == current - 1:
+                        intervals[-1][1] = current
+                    else:
+                        intervals.append([current, current])
+                stats.added += 1
+                current += 1
+                new_left -= 1
+            elif tag == "-":
+                stats.removed += 1
+                old_left -= 1
+            elif tag != "\\":
+                # Context line; some tools strip the leading space of blank ones
                 current += 1
+                old_left -= 1
+                new_left -= 1
+            continue
 
-        elif line.startswith(" ") and current is not None:
-            current += 1
+        if line.startswith("@@"):
+            match = HUNK_HEADER.match(line)
+            if not match:
+                continue
+            old_left = int(match.group(2) or 1)
+            current = int(match.group(3))
+            new_left = int(match.group(4) or 1)
+        elif line.startswith("diff --git"):
+            path = None
+            intervals = None
+        elif line.startswith("--- "):
+            old_path = _diff_path(line)
+            if old_path:
+                stats.old_files.append(old_path)
+        elif line.startswith("+++ "):
+            path = _diff_path(line)
+            intervals = None
+            if path:
+                stats.files.append(path)
+                intervals = stats.changed_lines.setdefault(path, [])
+
+    return stats
 
-    return changed
+def changed_files_from_diff(diff: str):
+    return parse_diff(diff.splitlines()).files
 
-def find_changed_symbols(symbols, changed_lines):
-    changed = []
+def changed_lines_from_diff(diff: str):
+    """Changed line intervals per file, see parse_diff."""
+    return parse_diff(diff.splitlines()).changed_lines
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
 
-    for fn in symbols["functions"]:
-        if any(fn["start_line"] <= l <= fn["end_line"] for l in changed_lines):
-            changed.append(("function", fn["name"]))
+def find_changed_symbols(symbols, changed_lines):
+    """Symbols whose span overlaps one file's [start, end] changed intervals.
+
+    Each innermost changed symbol is reported before the symbols enclosing
+    it, e.g. a method, then its class. Spans and intervals are both sorted,
+    so this is O((symbols + intervals) log intervals), not symbols x lines.
+    """
+    intervals = merge_intervals(changed_lines)
+    if not intervals:
+        return []
+    ends = [end for _, end in intervals]
+
+    spans = [
+        (sym["start_line"], -sym["end_line"], kind, sym["name"])
+        for kind, key in (("function", "functions"), ("class", "classes"))
+        for sym in symbols[key]
+    ]
+    spans.sort()
+
+    # Spans nest, so a stack sweep in start order yields each one's parent.
+    parents = []
+    stack = []
+    for i, (start, neg_end, _, _) in enumerate(spans):
+        while stack and -spans[stack[-1]][1] < start:
+            stack.pop()
+        parents.append(stack[-1] if stack else None)
+        stack.append(i)
+
+    hit = []
+    for start, neg_end, _, _ in spans:
+        # First interval ending at or after the span start
+        i = bisect_left(ends, start)
+        hit.append(i < len(intervals) and intervals[i][0] <= -neg_end)
+
+    # Ancestors of a hit always overlap too, so only hits can be innermost
+    has_hit_child = [False] * len(spans)
+    for i, parent in enumerate(parents):
+        if hit[i] and parent is not None:
+            has_hit_child[parent] = True
 
-    for cls in symbols["classes"]:
-        if any(cls["start_line"] <= l <= cls["end_line"] for l in changed_lines):
-            changed.append(("class", cls["name"]))
+    changed = []
+    reported = set()
+    for i in range(len(spans)):
+        if not hit[i] or has_hit_child[i]:
+            continue
+        node = i
+        while node is not None and node not in reported:
+            reported.add(node)
+            changed.append((spans[node][2], spans[node][3]))
+            node = parents[node]
 
     return changed
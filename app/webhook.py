@@ -1,9 +1,11 @@
 import os
 from fastapi import APIRouter, Request, HTTPException
 import hmac, hashlib
-from worker.tasks import analyze_pr
+from worker.tasks import analyze_pr, celery
 from app.redis_client import redis_client
+from app.pr_jobs import PR_DEBOUNCE_SECONDS, record_head
 import logging
+import uuid
 
 github_webhook = APIRouter()
 GITHUB_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET")
@@ -69,6 +71,21 @@ async def handle_webhook(request: Request):
         return {"status":"ignored fork PR"}
     
     # send request to celery worker
-    logger.info("Queueing PR analysis", extra={"pr": pr_number, "repo": repo})
-    analyze_pr.delay(repo,pr_number)
+    head_sha = pr["head"]["sha"]
+    task_id = uuid.uuid4().hex
+    previous_task_id = record_head(repo, pr_number, head_sha, task_id)
+    if previous_task_id:
+        # Still queued: dropped before it starts. Already running: it sees the
+        # new head at its next phase boundary and stops on its own.
+        celery.control.revoke(previous_task_id)
+        logger.info("Revoked superseded PR analysis", extra={"pr": pr_number, "repo": repo, "task_id": previous_task_id})
+    logger.info("Queueing PR analysis", extra={"pr": pr_number, "repo": repo, "head": head_sha})
+    # Only a push that lands while an earlier job is pending is part of a burst
+    # worth debouncing; a worker holds countdown messages outside its pool, so
+    # waiting never occupies a slot.
+    analyze_pr.apply_async(
+        (repo, pr_number, head_sha),
+        task_id=task_id,
+        countdown=PR_DEBOUNCE_SECONDS if previous_task_id else None,
+    )
     return {"status":"queued"}
\ No newline at end of file
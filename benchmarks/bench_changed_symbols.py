@@ -0,0 +1,69 @@
+"""Changed-symbol detection on a large synthetic module.
+
+    python -m benchmarks.bench_changed_symbols [classes]
+
+Compares the old per-symbol scan over every changed line with the
+interval lookup, for a PR that reformats the whole file (every other
+line changed) and for one that touches a single method.
+"""
+import sys
+import time
+import random
+
+from app.static_analysis import parse_code, extract_symbols, find_changed_symbols
+
+def synthetic_module(classes: int, methods: int = 8, body: int = 3) -> str:
+    lines = []
+    for c in range(classes):
+        lines.append(f"class C{c}:")
+        for m in range(methods):
+            lines.append(f"    def m{m}(self, x):")
+            for b in range(body):
+                lines.append(f"        x = x + {b}")
+            lines.append("        return x")
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+def scan_changed_symbols(symbols, changed_lines):
+    # The previous implementation, over a flat set of line numbers
+    changed = []
+    for fn in symbols["functions"]:
+        if any(fn["start_line"] <= l <= fn["end_line"] for l in changed_lines):
+            changed.append(("function", fn["name"]))
+    for cls in symbols["classes"]:
+        if any(cls["start_line"] <= l <= cls["end_line"] for l in changed_lines):
+            changed.append(("class", cls["name"]))
+    return changed
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+def main():
+    classes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    source = synthetic_module(classes)
+    total_lines = source.count("\n")
+    symbols = extract_symbols(parse_code(source))
+    print(f"{total_lines} lines, {len(symbols['functions']) + len(symbols['classes'])} symbols")
+
+    random.seed(0)
+    scenarios = {
+        "reformat": [[line, line] for line in range(1, total_lines + 1, 2)],
+        "one method": [[total_lines // 2, total_lines // 2 + 2]],
+        "scattered": [[line, line] for line in sorted(random.sample(range(1, total_lines), 50))],
+    }
+
+    print(f"{'scenario':<12} {'intervals':>9} {'scan':>9} {'bisect':>9}")
+    for name, intervals in scenarios.items():
+        lines = {line for start, end in intervals for line in range(start, end + 1)}
+        old, old_time = timed(lambda: scan_changed_symbols(symbols, lines))
+        new, new_time = timed(lambda: find_changed_symbols(symbols, intervals))
+        assert sorted(old) == sorted(new), name
+        print(f"{name:<12} {len(intervals):>9} {old_time:>8.3f}s {new_time:>8.4f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Nodes/sec of the recursive walk() extractors vs the compiled queries.
+
+    python -m benchmarks.bench_extract [path/to/repo]
+
+Without a path a synthetic module is generated.
+"""
+import os
+import sys
+import time
+
+from app.static_analysis import (
+    parse_code,
+    extract_all,
+    symbol_entry,
+    import_entries,
+    call_entry,
+)
+
+def recursive_walk(node):
+    yield node
+    for child in node.children:
+        yield from recursive_walk(child)
+
+def legacy_extract_all(tree):
+    # The pre-query extractors: one Python-level visit of every node per pass.
+    functions, classes, imports, calls = [], [], [], []
+    for node in recursive_walk(tree.root_node):
+        if node.type == "function_definition":
+            functions.append(symbol_entry(node))
+    for node in recursive_walk(tree.root_node):
+        if node.type == "class_definition":
+            classes.append(symbol_entry(node))
+    for node in recursive_walk(tree.root_node):
+        imports.extend(import_entries(node))
+    for node in recursive_walk(tree.root_node):
+        if node.type == "call":
+            call = call_entry(node)
+            if call:
+                calls.append(call)
+    return {
+        "functions": functions,
+        "classes": classes,
+        "imports": imports,
+        "calls": calls,
+    }
+
+def legacy_single_pass(tree):
+    functions, classes, imports, calls = [], [], [], []
+    for node in recursive_walk(tree.root_node):
+        if node.type == "function_definition":
+            functions.append(symbol_entry(node))
+        elif node.type == "class_definition":
+            classes.append(symbol_entry(node))
+        elif node.type in ("import_statement", "import_from_statement"):
+            imports.extend(import_entries(node))
+        elif node.type == "call":
+            call = call_entry(node)
+            if call:
+                calls.append(call)
+    return {
+        "functions": functions,
+        "classes": classes,
+        "imports": imports,
+        "calls": calls,
+    }
+
+def synthetic_source(n_functions=2000):
+    parts = ["import os\nfrom .util import helper as h\n"]
+    for i in range(n_functions):
+        parts.append(
+            f"class C{i}:\n"
+            f"    def m{i}(self, x):\n"
+            f"        return h(os.path.join(str(x), f{i}(x)))\n\n"
+            f"def f{i}(x):\n"
+            f"    return [helper(y) for y in range(x) if check(y, {i})]\n\n"
+        )
+    return "".join(parts).encode("utf-8")
+
+def load_sources(repo_dir):
+    sources = []
+    for root, _, files in os.walk(repo_dir):
+        for file in files:
+            if file.endswith(".py"):
+                with open(os.path.join(root, file), "rb") as f:
+                    sources.append(f.read())
+    return sources
+
+def bench(label, fn, trees, total_nodes):
+    start = time.perf_counter()
+    results = [fn(tree) for tree in trees]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {elapsed:8.3f}s  {total_nodes / elapsed:14,.0f} nodes/s")
+    return results
+
+def main():
+    sources = load_sources(sys.argv[1]) if len(sys.argv) > 1 else [synthetic_source()]
+    trees = [parse_code(source) for source in sources]
+    total_nodes = sum(tree.root_node.descendant_count for tree in trees)
+    print(f"{len(trees)} files, {total_nodes:,} nodes")
+
+    legacy = bench("walk x4", legacy_extract_all, trees, total_nodes)
+    single = bench("walk x1", legacy_single_pass, trees, total_nodes)
+    current = bench("query", extract_all, trees, total_nodes)
+    if not (legacy == single == current):
+        print("WARNING: extractor outputs differ")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Size and load time of the JSON graph cache entry vs the binary format.
+
+    python -m benchmarks.bench_graph_cache [path/to/repo]
+
+Defaults to indexing the running interpreter's standard library.
+"""
+import os
+import sys
+import json
+import time
+import logging
+
+from app.repo_index import build_repo_index
+from app.dependency_graph import build_symbol_graph
+from app.models import (
+    serialize_repo_index,
+    deserialize_repo_index,
+    serialize_symbol_graph,
+    deserialize_symbol_graph,
+    encode_graph,
+    decode_graph,
+)
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+def json_encode(repo_index, symbol_graph):
+    return json.dumps({
+        "repo_index": serialize_repo_index(repo_index),
+        "symbol_graph": serialize_symbol_graph(symbol_graph),
+    })
+
+def json_decode(raw):
+    data = json.loads(raw)
+    return (
+        deserialize_repo_index(data["repo_index"]),
+        deserialize_symbol_graph(data["symbol_graph"]),
+    )
+
+def main():
+    logging.disable(logging.INFO)
+    repo_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.__file__)
+    repo_index = build_repo_index(repo_dir)
+    symbol_graph = build_symbol_graph(repo_dir, repo_index)
+    edges = sum(len(callees) for callees in symbol_graph.values())
+    print(f"{len(repo_index)} files, {edges} graph edges")
+
+    raw_json, json_dump_time = timed(lambda: json_encode(repo_index, symbol_graph))
+    raw_bin, bin_dump_time = timed(lambda: encode_graph(repo_index, symbol_graph))
+    _, json_load_time = timed(lambda: json_decode(raw_json))
+    _, bin_load_time = timed(lambda: decode_graph(raw_bin))
+
+    print(f"{'format':<8} {'bytes':>12} {'encode':>9} {'decode':>9}")
+    print(f"{'json':<8} {len(raw_json.encode()):>12,} {json_dump_time:>8.3f}s {json_load_time:>8.3f}s")
+    print(f"{'binary':<8} {len(raw_bin):>12,} {bin_dump_time:>8.3f}s {bin_load_time:>8.3f}s")
+
+if __name__ == "__main__":
+    main()
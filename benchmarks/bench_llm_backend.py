@@ -0,0 +1,39 @@
+"""Throughput of the LLM layer against the offline stub backend.
+
+    python -m benchmarks.bench_llm_backend [requests] [latency_ms] [error_rate]
+
+Measures the event loop, in-flight cap and retry path without the network
+or Redis (the stub is not rate limited, and the explanation cache is
+bypassed).
+"""
+import sys
+import time
+import asyncio
+import logging
+
+from app.api_service import LLM_MAX_IN_FLIGHT, generate_async, run_async, set_backend
+from app.llm_backends import StubBackend
+
+async def explain_many(count: int):
+    return await asyncio.gather(
+        *(generate_async("system", f"prompt {i}") for i in range(count)),
+        return_exceptions=True,
+    )
+
+def main():
+    logging.disable(logging.WARNING)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 50
+    error_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    set_backend(StubBackend(latency_ms=latency_ms, error_rate=error_rate))
+
+    start = time.perf_counter()
+    results = run_async(explain_many(count)).result()
+    elapsed = time.perf_counter() - start
+
+    failed = sum(isinstance(r, Exception) for r in results)
+    print(f"{count} requests, {latency_ms:.0f}ms mean latency, {error_rate:.0%} errors, {LLM_MAX_IN_FLIGHT} in flight")
+    print(f"{elapsed:.2f}s total, {count / elapsed:.1f} req/s, {failed} failed after retries")
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,84 @@
-from celery import Celery
-from app.github import post_pr_comment
+from celery import Celery, signals
+from celery.worker import state as worker_state
+from app.github import ProgressiveComment
 from dotenv import load_dotenv
 import logging
+import os
 import uuid 
 from app.workspace import job_workspace
 from app.git_ops import clone_and_analyze_pr
+from app.pr_jobs import JobSuperseded, finish_job
+from app import routing
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Post the structural summary first, then edit in explanations as they land
+PROGRESSIVE_COMMENTS = os.getenv("PROGRESSIVE_COMMENTS", "1") == "1"
+
 celery = Celery(
     "worker",
     broker="redis://redis:6379/0"
 )
+celery.conf.task_routes = (routing.route_task,)
+# Reserve one job at a time, so overflow reaches whichever worker is idle
+celery.conf.worker_prefetch_multiplier = 1
+
+# Set in the main worker process before the pool forks
+_worker = {}
+
+@signals.celeryd_after_setup.connect
+def setup_worker_queue(sender, instance, **kwargs):
+    if not routing.WORKER_AFFINITY:
+        return
+    # Each worker consumes its own queue on top of the shared one
+    instance.app.amqp.queues.select_add(routing.worker_queue(sender))
+    _worker.update(name=sender, concurrency=instance.concurrency)
+
+@signals.worker_ready.connect
+def join_ring(**kwargs):
+    if not _worker:
+        return
+    routing.register_worker(_worker["name"], _worker["concurrency"])
+    # Reserved requests live in this (main) process, whatever the pool type
+    _worker["stop"] = routing.start_heartbeat(
+        _worker["name"],
+        _worker["concurrency"],
+        lambda: len(worker_state.reserved_requests),
+    )
+    logger.info("Joined the routing ring", extra={"worker": _worker["name"]})
+
+@signals.worker_shutdown.connect
+def leave_ring(**kwargs):
+    if "stop" not in _worker:
+        return
+    _worker["stop"].set()
+    routing.unregister_worker(_worker["name"])
+
+@celery.task(bind=True)
+def analyze_pr(self, repo: str, pr_number: int, head_sha: str = None):
+    try:
+        _analyze_pr(repo, pr_number, head_sha)
+    finally:
+        # Later pushes start right away again instead of waiting out a debounce
+        finish_job(repo, pr_number, self.request.id)
 
-@celery.task
-def analyze_pr(repo: str, pr_number: int):
+def _analyze_pr(repo: str, pr_number: int, head_sha: str = None):
     job_id = uuid.uuid4().hex
     with job_workspace(job_id) as workspace:
         logger.info(f"Using workspace {workspace}", extra={"path": workspace,"job_id":job_id,"pr":pr_number})
-        summary = clone_and_analyze_pr(repo, pr_number, workspace)
+        comment = ProgressiveComment(repo, pr_number)
+        try:
+            summary = clone_and_analyze_pr(
+                repo,
+                pr_number,
+                workspace,
+                on_progress=comment.publish if PROGRESSIVE_COMMENTS else None,
+                head_sha=head_sha,
+            )
+        except JobSuperseded as e:
+            # The job for the newer head posts the review
+            logger.info(f"Abandoning stale analysis: {e}", extra={"repo": repo, "pr": pr_number, "job_id": job_id})
+            return
         logger.info("Analyzing PR", extra={"repo": repo, "pr": pr_number})
-        post_pr_comment(
-            repo,
-            pr_number,
-            summary
-        )
\ No newline at end of file
+        # Updates Prism's existing comment on the PR rather than adding one
+        comment.publish(summary, final=True)
\ No newline at end of file